@@ -5,16 +5,16 @@
 """
 
 import argparse
-import json
 import os
 import sys
-from dataclasses import asdict
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Any
 
 from dotenv import load_dotenv
 
-from src.trade_decoder import get_web3, decode_transaction
+from src.trade_decoder import get_web3, decode_transaction_batch
 from src.market_decoder import decode_market_from_gamma
+from src.json_output import write_json
 
 
 def main():
@@ -49,14 +49,19 @@ def main():
         print("Polymarket Stage 1 Demo", file=sys.stderr)
         print("=" * 60, file=sys.stderr)
         
-        # 1. 解码交易
-        print(f"\n[1/2] Decoding transaction: {args.tx_hash}", file=sys.stderr)
-        trades = decode_transaction(w3, args.tx_hash)
-        print(f"✓ Found {len(trades)} trade(s)", file=sys.stderr)
-        
-        # 2. 解码市场
-        print(f"\n[2/2] Fetching market from Gamma API: {args.event_slug}", file=sys.stderr)
-        market_params = decode_market_from_gamma(args.event_slug)
+        # 交易解码 (RPC) 与市场解码 (Gamma HTTP) 互不依赖，并发执行以重叠网络等待
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            trades_future = executor.submit(decode_transaction_batch, w3, args.tx_hash)
+            market_future = executor.submit(decode_market_from_gamma, args.event_slug)
+            
+            # 1. 解码交易
+            print(f"\n[1/2] Decoding transaction: {args.tx_hash}", file=sys.stderr)
+            trades = trades_future.result()
+            print(f"✓ Found {len(trades)} trade(s)", file=sys.stderr)
+            
+            # 2. 解码市场
+            print(f"\n[2/2] Fetching market from Gamma API: {args.event_slug}", file=sys.stderr)
+            market_params = market_future.result()
         print(f"✓ Market decoded successfully", file=sys.stderr)
         print(f"  Condition ID: {market_params.condition_id[:10]}...", file=sys.stderr)
         print(f"  Oracle: {market_params.oracle}", file=sys.stderr)
@@ -65,23 +70,26 @@ def main():
         
         # 3. 匹配交易和市场
         print(f"\n[3/3] Matching trades with market", file=sys.stderr)
-        matched_trades = []
-        unmatched_trades = []
+        yes_token_lower = market_params.yes_token_id.lower()
+        no_token_lower = market_params.no_token_id.lower()
         
-        for trade in trades:
-            token_id_lower = trade.token_id.lower()
-            yes_token_lower = market_params.yes_token_id.lower()
-            no_token_lower = market_params.no_token_id.lower()
-            
-            if token_id_lower == yes_token_lower:
-                matched_trades.append((trade, "YES"))
-                print(f"  ✓ Trade {trade.log_index}: YES token @ {trade.price}", file=sys.stderr)
-            elif token_id_lower == no_token_lower:
-                matched_trades.append((trade, "NO"))
-                print(f"  ✓ Trade {trade.log_index}: NO token @ {trade.price}", file=sys.stderr)
+        # 按列匹配：只扫描 token_id 列，outcomes 与 trades 下标一一对应
+        outcomes = [
+            "YES" if token_id_lower == yes_token_lower
+            else "NO" if token_id_lower == no_token_lower
+            else None
+            for token_id_lower in (token_id.lower() for token_id in trades.columns['token_id'])
+        ]
+        
+        for log_index, price, outcome in zip(
+            trades.columns['log_index'], trades.columns['price'], outcomes
+        ):
+            if outcome is not None:
+                print(f"  ✓ Trade {log_index}: {outcome} token @ {price}", file=sys.stderr)
             else:
-                unmatched_trades.append(trade)
-                print(f"  ✗ Trade {trade.log_index}: Unmatched token", file=sys.stderr)
+                print(f"  ✗ Trade {log_index}: Unmatched token", file=sys.stderr)
+        
+        matched_count = sum(1 for outcome in outcomes if outcome is not None)
         
         # 4. 构建输出
         result = {
@@ -90,34 +98,32 @@ def main():
                 "event_slug": args.event_slug,
                 "summary": {
                     "total_trades": len(trades),
-                    "matched_trades": len(matched_trades),
-                    "unmatched_trades": len(unmatched_trades)
+                    "matched_trades": matched_count,
+                    "unmatched_trades": len(trades) - matched_count
                 },
                 "trades": [
                     {
-                        **asdict(trade),
-                        "matched_outcome": outcome if any(t[0] == trade for t in matched_trades) else None
+                        **trade_dict,
+                        "matched_outcome": outcome
                     }
-                    for trade in trades
-                    for outcome in [next((o for t, o in matched_trades if t == trade), None)]
+                    for trade_dict, outcome in zip(trades.to_dicts(), outcomes)
                 ],
-                "market": asdict(market_params)
+                "market": market_params.to_dict()
             }
         }
         
         # 5. 输出结果
-        output_json = json.dumps(result, indent=2)
-        
         if args.output:
             os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
             with open(args.output, 'w') as f:
-                f.write(output_json)
+                write_json(result, f)
             print(f"\n✓ Results written to {args.output}", file=sys.stderr)
         else:
             print("\n" + "=" * 60, file=sys.stderr)
             print("Output:", file=sys.stderr)
             print("=" * 60, file=sys.stderr)
-            print(output_json)
+            write_json(result, sys.stdout)
+            sys.stdout.write("\n")
         
         print("\n" + "=" * 60, file=sys.stderr)
         print("Demo completed successfully!", file=sys.stderr)
@@ -5,19 +5,65 @@ Polymarket Gamma API Client
 """
 
 import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
 from typing import Optional, Dict, Any, List
+import copy
+import json
 import os
+import time
+from functools import lru_cache
 
 
 # Gamma API 默认端点
 DEFAULT_GAMMA_BASE_URL = "https://gamma-api.polymarket.com"
 
+# 请求超时（秒）
+REQUEST_TIMEOUT = 10
+
+# 同一 slug 的响应缓存有效期（秒），可通过 GAMMA_CACHE_TTL 覆盖
+DEFAULT_CACHE_TTL = 60
+
+# 模块级会话，复用 TCP/TLS 连接（keep-alive）
+_SESSION = requests.Session()
+_SESSION.headers.update({"Accept": "application/json"})
+_SESSION.mount("https://", HTTPAdapter(pool_connections=10, pool_maxsize=20))
+_SESSION.mount("http://", HTTPAdapter(pool_connections=10, pool_maxsize=20))
+
 
 def get_gamma_base_url() -> str:
     """获取 Gamma API 基础 URL"""
     return os.getenv("GAMMA_API_BASE_URL", DEFAULT_GAMMA_BASE_URL)
 
 
+@lru_cache(maxsize=1)
+def _get_cache_ttl() -> int:
+    """获取 Gamma 响应缓存的有效期（秒），只解析一次，GAMMA_CACHE_TTL 无效时使用默认值"""
+    try:
+        return max(1, int(os.getenv("GAMMA_CACHE_TTL", DEFAULT_CACHE_TTL)))
+    except ValueError:
+        return DEFAULT_CACHE_TTL
+
+
+@lru_cache(maxsize=256)
+def _get_json_cached(url: str, ttl_bucket: int) -> Dict[str, Any]:
+    """
+    GET 请求并缓存 JSON 结果
+
+    ttl_bucket 随时间窗口变化，使旧结果在 TTL 过期后自然失效；
+    请求失败时抛出异常，不会写入缓存。
+    """
+    response = _SESSION.get(url, timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+    return response.json()
+
+
+def _get_json(url: str) -> Dict[str, Any]:
+    """带 TTL 缓存的 GET 请求，返回结果的深拷贝以免调用方修改缓存（含嵌套的列表、字典）"""
+    ttl = _get_cache_ttl()
+    return copy.deepcopy(_get_json_cached(url, int(time.time() // ttl)))
+
+
 def fetch_event_by_slug(base_url: Optional[str], slug: str) -> Dict[str, Any]:
     """
     通过 slug 获取事件信息
@@ -36,9 +82,7 @@ def fetch_event_by_slug(base_url: Optional[str], slug: str) -> Dict[str, Any]:
         base_url = get_gamma_base_url()
     
     url = f"{base_url}/events/{slug}"
-    response = requests.get(url)
-    response.raise_for_status()
-    return response.json()
+    return _get_json(url)
 
 
 def fetch_market_by_slug(base_url: Optional[str], slug: str) -> Dict[str, Any]:
@@ -60,9 +104,7 @@ def fetch_market_by_slug(base_url: Optional[str], slug: str) -> Dict[str, Any]:
     
     # Gamma API 的正确 URL 格式是 /markets/slug/{slug}
     url = f"{base_url}/markets/slug/{slug}"
-    response = requests.get(url)
-    response.raise_for_status()
-    return response.json()
+    return _get_json(url)
 
 
 def fetch_market_by_condition_or_tokens(
@@ -73,6 +115,8 @@ def fetch_market_by_condition_or_tokens(
     """
     通过 conditionId 或 tokenIds 查找市场
     
+    token_ids 并发查询，返回最先命中的市场，不保证按输入顺序优先。
+    
     Args:
         base_url: Gamma API 基础 URL (如果为 None，使用默认值)
         condition_id: 条件 ID
@@ -97,7 +141,7 @@ def fetch_market_by_condition_or_tokens(
             # 注意：Gamma API 可能需要特定的查询格式
             url = f"{base_url}/markets"
             params = {"condition_id": condition_id.lower()}
-            response = requests.get(url, params=params)
+            response = _SESSION.get(url, params=params, timeout=REQUEST_TIMEOUT)
             
             if response.status_code == 200:
                 markets = response.json()
@@ -108,23 +152,49 @@ def fetch_market_by_condition_or_tokens(
     
     # 如果通过 condition_id 没找到，或者只提供了 token_ids，则尝试通过 token_ids 查询
     if token_ids:
+        url = f"{base_url}/markets"
+        # 注意：具体的 API 参数可能需要根据实际 API 文档调整
+        # 并发查询所有 token_id，取最先返回的命中结果；命中后不等待其余请求
+        executor = ThreadPoolExecutor(max_workers=min(8, len(token_ids)))
         try:
-            url = f"{base_url}/markets"
-            # 注意：具体的 API 参数可能需要根据实际 API 文档调整
-            for token_id in token_ids:
-                params = {"token_id": token_id.lower()}
-                response = requests.get(url, params=params)
-                
-                if response.status_code == 200:
-                    markets = response.json()
-                    if markets and len(markets) > 0:
-                        return markets[0]
-        except Exception as e:
-            print(f"Error fetching by token_ids: {e}")
+            futures = [
+                executor.submit(
+                    _SESSION.get,
+                    url,
+                    params={"token_id": token_id.lower()},
+                    timeout=REQUEST_TIMEOUT
+                )
+                for token_id in token_ids
+            ]
+            
+            for future in as_completed(futures):
+                try:
+                    response = future.result()
+                    if response.status_code == 200:
+                        markets = response.json()
+                        if markets and len(markets) > 0:
+                            return markets[0]
+                except Exception as e:
+                    print(f"Error fetching by token_ids: {e}")
+        finally:
+            # 未开始的查询直接取消，进行中的请求在后台结束
+            executor.shutdown(wait=False, cancel_futures=True)
     
     return None
 
 
+def _format_token_id(token_id: Any) -> Any:
+    """将十进制 token ID（非负整数或纯数字字符串）转为 0x 开头的 64 位十六进制，其它值原样返回"""
+    if isinstance(token_id, str):
+        # 只接受纯 ASCII 数字，"-5"、" 12 " 之类 int() 能解析的输入不转换
+        if token_id.isdigit() and token_id.isascii():
+            return f"0x{int(token_id):064x}"
+        return token_id
+    if isinstance(token_id, int) and token_id >= 0:
+        return f"0x{token_id:064x}"
+    return token_id
+
+
 def extract_market_params(market_data: Dict[str, Any]) -> Dict[str, Any]:
     """
     从 Gamma API 返回的市场数据中提取关键参数
@@ -157,24 +227,15 @@ def extract_market_params(market_data: Dict[str, Any]) -> Dict[str, Any]:
     # Token IDs - 可能是字符串（JSON）或列表
     clob_token_ids = market_data.get('clobTokenIds', market_data.get('tokenIds', []))
     
-    # 如果是字符串，尝试解析 JSON
+    # 如果是字符串，尝试解析 JSON（用标准库：orjson 会把超过 64 位的整数解析成 float，丢失精度）
     if isinstance(clob_token_ids, str):
         try:
-            import json
             clob_token_ids = json.loads(clob_token_ids)
-        except:
+        except ValueError:
             clob_token_ids = []
     
     # 转换为十六进制格式（如果是十进制数字字符串）
-    formatted_token_ids = []
-    for token_id in clob_token_ids:
-        if isinstance(token_id, str) and token_id.isdigit():
-            # 十进制转十六进制
-            formatted_token_ids.append(f"0x{int(token_id):064x}")
-        elif isinstance(token_id, int):
-            formatted_token_ids.append(f"0x{token_id:064x}")
-        else:
-            formatted_token_ids.append(token_id)
+    formatted_token_ids = [_format_token_id(token_id) for token_id in clob_token_ids]
     
     params['clob_token_ids'] = formatted_token_ids
     
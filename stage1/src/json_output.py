@@ -0,0 +1,45 @@
+"""
+JSON 工具
+
+优先使用 orjson（C 实现）序列化/解析，未安装时回退到标准库 json。
+"""
+
+import json
+from typing import Any, TextIO
+
+try:
+    import orjson
+except ImportError:  # orjson 为可选依赖
+    orjson = None
+
+
+def write_json(obj: Any, fp: TextIO) -> None:
+    """
+    将结果以缩进 2 空格的 JSON 直接写入文本流（文件或 sys.stdout）
+
+    不构造中间字符串：orjson 的 bytes 结果直接写入底层二进制缓冲区，
+    标准库 json 则边编码边写入。
+
+    Args:
+        obj: 待序列化的对象
+        fp: 文本模式打开的文件对象
+    """
+    if orjson is not None:
+        try:
+            data = orjson.dumps(obj, option=orjson.OPT_INDENT_2)
+        except TypeError:
+            # orjson 不支持超过 64 位的整数等类型，回退到标准库
+            data = None
+        
+        if data is not None:
+            buffer = getattr(fp, 'buffer', None)
+            if buffer is None:
+                fp.write(data.decode())
+            else:
+                fp.flush()
+                buffer.write(data)
+                buffer.flush()
+            return
+    
+    json.dump(obj, fp, indent=2)
+
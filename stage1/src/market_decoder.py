@@ -5,16 +5,16 @@ Market Decoder - 任务 B
 """
 
 import argparse
-import json
 import os
 import sys
-from dataclasses import dataclass, asdict
+from dataclasses import dataclass
 from typing import Optional, Dict, Any
 
-from dotenv import load_dotenv
 from web3 import Web3
 
 from src.ctf.derive import derive_binary_positions, get_condition_id
+from src.json_output import write_json
+from src.rpc import get_web3, get_transaction_receipt
 from src.indexer.gamma import (
     fetch_market_by_slug,
     extract_market_params,
@@ -27,16 +27,24 @@ USDC_ADDRESS = "0x2791Bca1f2de4661ED88A30C99A7a9449Aa84174"
 
 # ConditionalTokens 合约地址 (Polygon)
 CONDITIONAL_TOKENS = "0x4D97DCd97eC945f40cF65F87097ACe5EA0476045"
+_CONDITIONAL_TOKENS_LC = CONDITIONAL_TOKENS.lower()
 
 # ConditionPreparation 事件签名
 # event ConditionPreparation(bytes32 indexed conditionId, address indexed oracle, 
 #                            bytes32 indexed questionId, uint256 outcomeSlotCount)
-CONDITION_PREPARATION_TOPIC = Web3.keccak(
-    text="ConditionPreparation(bytes32,address,bytes32,uint256)"
-).hex()
+CONDITION_PREPARATION_SIGNATURE = "ConditionPreparation(bytes32,address,bytes32,uint256)"
+# keccak256(CONDITION_PREPARATION_SIGNATURE)，预先计算以免每次导入时重新哈希
+CONDITION_PREPARATION_TOPIC_BYTES = bytes.fromhex(
+    "ab3760c3bd2bb38b5bcf54dc79802ed67338b4cf29f3054ded67ed24661e4177"
+)
+CONDITION_PREPARATION_TOPIC = '0x' + CONDITION_PREPARATION_TOPIC_BYTES.hex()
+
+if sys.flags.debug:
+    # 仅在 PYTHONDEBUG 下校验预计算的哈希
+    assert bytes(Web3.keccak(text=CONDITION_PREPARATION_SIGNATURE)) == CONDITION_PREPARATION_TOPIC_BYTES
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=True, slots=True)
 class MarketParams:
     """市场参数数据结构"""
     condition_id: str
@@ -48,21 +56,18 @@ class MarketParams:
     no_token_id: str
     gamma: Optional[Dict[str, Any]] = None
 
-
-def get_web3() -> Web3:
-    """创建 Web3 实例"""
-    load_dotenv()
-    rpc_url = os.getenv("RPC_URL")
-    
-    if not rpc_url:
-        raise ValueError("RPC_URL not found in environment. Please set it in .env file")
-    
-    w3 = Web3(Web3.HTTPProvider(rpc_url))
-    
-    if not w3.is_connected():
-        raise ConnectionError(f"Failed to connect to RPC: {rpc_url}")
-    
-    return w3
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为字典（gamma 仅做浅拷贝）"""
+        return {
+            'condition_id': self.condition_id,
+            'oracle': self.oracle,
+            'question_id': self.question_id,
+            'outcome_slot_count': self.outcome_slot_count,
+            'collateral_token': self.collateral_token,
+            'yes_token_id': self.yes_token_id,
+            'no_token_id': self.no_token_id,
+            'gamma': dict(self.gamma) if self.gamma is not None else None
+        }
 
 
 def parse_condition_preparation_log(log: Dict[str, Any]) -> Dict[str, Any]:
@@ -192,7 +197,12 @@ def decode_market_from_gamma(market_slug: str) -> MarketParams:
     )
 
 
-def decode_market_from_tx(w3: Web3, tx_hash: str, log_index: Optional[int] = None) -> MarketParams:
+def decode_market_from_tx(
+    w3: Web3,
+    tx_hash: str,
+    log_index: Optional[int] = None,
+    receipt: Optional[Dict[str, Any]] = None
+) -> MarketParams:
     """
     从交易中的 ConditionPreparation 事件解析市场参数
     
@@ -200,12 +210,14 @@ def decode_market_from_tx(w3: Web3, tx_hash: str, log_index: Optional[int] = Non
         w3: Web3 实例
         tx_hash: 交易哈希
         log_index: 日志索引 (可选，如果有多个日志)
+        receipt: 已获取的交易回执 (可选，避免重复请求)
     
     Returns:
         MarketParams 对象
     """
     # 获取交易回执
-    receipt = w3.eth.get_transaction_receipt(tx_hash)
+    if receipt is None:
+        receipt = get_transaction_receipt(w3, tx_hash)
     
     # 查找 ConditionPreparation 事件
     condition_logs = []
@@ -214,9 +226,11 @@ def decode_market_from_tx(w3: Web3, tx_hash: str, log_index: Optional[int] = Non
         # 检查是否是 ConditionalTokens 合约的日志
         log_address = log['address']
         if isinstance(log_address, str):
-            log_address = Web3.to_checksum_address(log_address)
+            address_lc = log_address.lower()
+        else:
+            address_lc = '0x' + bytes(log_address).hex()
         
-        if log_address.lower() != CONDITIONAL_TOKENS.lower():
+        if address_lc != _CONDITIONAL_TOKENS_LC:
             continue
         
         # 检查是否是 ConditionPreparation 事件
@@ -224,9 +238,10 @@ def decode_market_from_tx(w3: Web3, tx_hash: str, log_index: Optional[int] = Non
             continue
         
         topic0 = log['topics'][0]
-        topic0_hex = topic0.hex() if isinstance(topic0, bytes) else topic0
+        if isinstance(topic0, str):
+            topic0 = bytes.fromhex(topic0[2:] if topic0.startswith('0x') else topic0)
         
-        if topic0_hex.lower() != CONDITION_PREPARATION_TOPIC.lower():
+        if topic0 != CONDITION_PREPARATION_TOPIC_BYTES:
             continue
         
         condition_logs.append(log)
@@ -300,20 +315,19 @@ def main():
             market_params = decode_market_from_tx(w3, args.tx_hash, args.log_index)
         
         # 转换为字典
-        result = asdict(market_params)
+        result = market_params.to_dict()
         
         # 输出结果
-        output_json = json.dumps(result, indent=2)
-        
         if args.output:
             # 创建输出目录
             os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
             
             with open(args.output, 'w') as f:
-                f.write(output_json)
+                write_json(result, f)
             print(f"Results written to {args.output}", file=sys.stderr)
         else:
-            print(output_json)
+            write_json(result, sys.stdout)
+            sys.stdout.write("\n")
         
     except Exception as e:
         print(f"Error: {e}", file=sys.stderr)
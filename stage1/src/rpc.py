@@ -0,0 +1,68 @@
+"""
+RPC 客户端
+
+提供进程内共享的 Web3 实例，避免重复创建连接和重复的连通性检查。
+"""
+
+import os
+from functools import lru_cache
+from typing import Any, Dict, Optional
+
+import requests
+from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from web3 import Web3
+
+
+# RPC 请求超时（秒）
+RPC_TIMEOUT = 30
+
+# 进程内共享的 Web3 实例
+_W3: Optional[Web3] = None
+
+
+def get_web3() -> Web3:
+    """获取共享的 Web3 实例（首次调用时创建并检查连接）"""
+    global _W3
+
+    if _W3 is not None:
+        return _W3
+
+    load_dotenv()
+    rpc_url = os.getenv("RPC_URL")
+
+    if not rpc_url:
+        raise ValueError("RPC_URL not found in environment. Please set it in .env file")
+
+    # 持久会话，重复的 eth_getTransactionReceipt 调用复用连接
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_maxsize=20)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    w3 = Web3(Web3.HTTPProvider(
+        rpc_url,
+        request_kwargs={'timeout': RPC_TIMEOUT},
+        session=session
+    ))
+
+    if not w3.is_connected():
+        raise ConnectionError(f"Failed to connect to RPC: {rpc_url}")
+
+    _W3 = w3
+    return _W3
+
+
+@lru_cache(maxsize=256)
+def get_transaction_receipt(w3: Web3, tx_hash: str) -> Dict[str, Any]:
+    """
+    获取交易回执（按 (w3, tx_hash) 缓存，已上链的回执不会变化）
+
+    Args:
+        w3: Web3 实例
+        tx_hash: 交易哈希
+
+    Returns:
+        交易回执
+    """
+    return w3.eth.get_transaction_receipt(tx_hash)
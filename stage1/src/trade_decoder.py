@@ -5,16 +5,18 @@ Trade Decoder - 任务 A
 """
 
 import argparse
-import json
 import os
 import sys
-from dataclasses import dataclass, asdict
-from decimal import Decimal
-from typing import List, Optional, Dict, Any
+from dataclasses import dataclass, fields
+from functools import lru_cache
+from typing import List, Optional, Dict, Any, Tuple, Iterator, Iterable
 
-from dotenv import load_dotenv
 from web3 import Web3
 
+from src.json_output import write_json
+from src.rpc import get_web3, get_transaction_receipt
+from src.trade_decoder_fast import BATCH_THRESHOLD, decode_amounts_batch
+
 
 # Polymarket 交易所合约地址
 CTF_EXCHANGE = "0x4bFb41d5B3570DeFd03C39a9A4D8dE6Bd8B8982E"  # 普通二元市场
@@ -24,10 +26,26 @@ NEGRISK_CTF_EXCHANGE = "0xC5d563A36AE78145C45a50134d48A1215220f80a"  # 负风险
 # event OrderFilled(bytes32 indexed orderHash, address indexed maker, address indexed taker, 
 #                   uint256 makerAssetId, uint256 takerAssetId, uint256 makerAmountFilled,
 #                   uint256 takerAmountFilled, uint256 fee)
-ORDER_FILLED_TOPIC = Web3.keccak(text="OrderFilled(bytes32,address,address,uint256,uint256,uint256,uint256,uint256)").hex()
+ORDER_FILLED_SIGNATURE = "OrderFilled(bytes32,address,address,uint256,uint256,uint256,uint256,uint256)"
+# keccak256(ORDER_FILLED_SIGNATURE)，预先计算以免每次导入时重新哈希
+ORDER_FILLED_TOPIC_BYTES = bytes.fromhex("d0a08e8c493f9c94f29311604c9de1b4e8c8d4c06bd0c789af57f2d65bfec0f6")
+ORDER_FILLED_TOPIC = '0x' + ORDER_FILLED_TOPIC_BYTES.hex()
+
+if sys.flags.debug:
+    # 仅在 PYTHONDEBUG 下校验预计算的哈希
+    assert bytes(Web3.keccak(text=ORDER_FILLED_SIGNATURE)) == ORDER_FILLED_TOPIC_BYTES
+
+# OrderFilled data 中 5 个 uint256 字段的偏移量
+_ORDER_FILLED_DATA_OFFSETS = range(0, 160, 32)
 
+# 小写地址 -> 交易所地址，逐条日志比较时无需再计算 checksum
+_EXCHANGE_BY_ADDRESS_LC = {
+    CTF_EXCHANGE.lower(): CTF_EXCHANGE,
+    NEGRISK_CTF_EXCHANGE.lower(): NEGRISK_CTF_EXCHANGE,
+}
 
-@dataclass(frozen=True)
+
+@dataclass(frozen=True, slots=True)
 class Trade:
     """交易数据结构"""
     tx_hash: str
@@ -45,34 +63,137 @@ class Trade:
     token_id: str
     side: str
 
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为字典（字段均为不可变类型，无需 asdict 的深拷贝）"""
+        return {
+            'tx_hash': self.tx_hash,
+            'log_index': self.log_index,
+            'exchange': self.exchange,
+            'order_hash': self.order_hash,
+            'maker': self.maker,
+            'taker': self.taker,
+            'maker_asset_id': self.maker_asset_id,
+            'taker_asset_id': self.taker_asset_id,
+            'maker_amount': self.maker_amount,
+            'taker_amount': self.taker_amount,
+            'fee': self.fee,
+            'price': self.price,
+            'token_id': self.token_id,
+            'side': self.side
+        }
+
 
-def get_web3() -> Web3:
-    """创建 Web3 实例"""
-    load_dotenv()
-    rpc_url = os.getenv("RPC_URL")
+# Trade 字段顺序，TradeBatch 的列与之一一对应
+TRADE_FIELDS = tuple(f.name for f in fields(Trade))
+
+
+class TradeBatch:
+    """
+    一批交易的列式存储 (Struct-of-Arrays)
+    
+    每个字段保存为一列，按下标访问时才构造 Trade 对象，导出时直接按列生成字典。
+    """
+    
+    def __init__(self, rows: List[Tuple[Any, ...]]):
+        """
+        Args:
+            rows: 按 TRADE_FIELDS 顺序排列的行元组列表
+        """
+        self._size = len(rows)
+        columns = list(zip(*rows)) if rows else [() for _ in TRADE_FIELDS]
+        self.columns: Dict[str, Tuple[Any, ...]] = dict(zip(TRADE_FIELDS, columns))
     
-    if not rpc_url:
-        raise ValueError("RPC_URL not found in environment. Please set it in .env file")
+    def __len__(self) -> int:
+        return self._size
     
-    w3 = Web3(Web3.HTTPProvider(rpc_url))
+    def __getitem__(self, index: int) -> Trade:
+        return Trade(*(self.columns[name][index] for name in TRADE_FIELDS))
     
-    if not w3.is_connected():
-        raise ConnectionError(f"Failed to connect to RPC: {rpc_url}")
+    def __iter__(self) -> Iterator[Trade]:
+        for row in zip(*self.columns.values()):
+            yield Trade(*row)
     
-    return w3
+    def to_dicts(self) -> List[Dict[str, Any]]:
+        """转换为字典列表，不经过 Trade 对象"""
+        return [dict(zip(TRADE_FIELDS, row)) for row in zip(*self.columns.values())]
+
+
+@lru_cache(maxsize=4096)
+def _checksum(address_lc: str) -> str:
+    """计算 checksum 地址（缓存，做市商地址会反复出现）"""
+    return Web3.to_checksum_address(address_lc)
+
 
+def _topic_address_lc(topic: Any) -> str:
+    """从 indexed topic 中提取小写地址 (最后 20 bytes)"""
+    return '0x' + (topic.hex()[-40:] if isinstance(topic, bytes) else topic[-40:]).lower()
 
-def parse_order_filled_log(log: Dict[str, Any], exchange: str) -> Trade:
+
+def format_price(usdc_amount: int, token_amount: int) -> str:
+    """
+    用整数定点运算计算价格字符串（保留 6 位小数，去掉末尾 0）
+    
+    Args:
+        usdc_amount: USDC 数量
+        token_amount: Token 数量
+    
+    Returns:
+        价格字符串，token_amount 为 0 时返回 "0"
+    """
+    if token_amount <= 0:
+        return "0"
+    
+    q, r = divmod(usdc_amount * 1_000_000, token_amount)
+    # 与 Decimal 格式化一致，采用四舍六入五成双
+    if 2 * r > token_amount or (2 * r == token_amount and q & 1):
+        q += 1
+    
+    return format_price_micro(q)
+
+
+def format_price_micro(price_micro: int) -> str:
+    """将放大 10^6 倍的整数价格格式化为字符串（去掉末尾 0）"""
+    whole, frac = divmod(price_micro, 1_000_000)
+    return f"{whole}.{frac:06d}".rstrip('0').rstrip('.')
+
+
+def _log_data_bytes(log: Dict[str, Any]) -> bytes:
+    """获取日志 data 的 bytes 形式"""
+    data = log['data']
+    if isinstance(data, str):
+        data = data if data.startswith('0x') else '0x' + data
+        return bytes.fromhex(data[2:])
+    return data
+
+
+def parse_order_filled_log(
+    log: Dict[str, Any],
+    exchange: str,
+    taker_lc: Optional[str] = None,
+    amounts: Optional[Tuple[int, int, int, int]] = None
+) -> Trade:
     """
     解析 OrderFilled 日志
     
     Args:
         log: 交易日志
         exchange: 交易所合约地址
+        taker_lc: 已提取的小写 taker 地址 (可选，避免重复解析)
+        amounts: 批量路径已解析的 (maker_amount, taker_amount, fee, price_micro) (可选)
     
     Returns:
         Trade 对象
     """
+    return Trade(*_parse_order_filled_row(log, exchange, taker_lc, amounts))
+
+
+def _parse_order_filled_row(
+    log: Dict[str, Any],
+    exchange: str,
+    taker_lc: Optional[str] = None,
+    amounts: Optional[Tuple[int, int, int, int]] = None
+) -> Tuple[Any, ...]:
+    """解析 OrderFilled 日志为按 TRADE_FIELDS 顺序排列的元组"""
     # 提取 topics
     topics = log['topics']
     
@@ -81,24 +202,30 @@ def parse_order_filled_log(log: Dict[str, Any], exchange: str) -> Trade:
     # topic[2] 是 maker (indexed)
     # topic[3] 是 taker (indexed)
     order_hash = topics[1].hex() if isinstance(topics[1], bytes) else topics[1]
-    maker = Web3.to_checksum_address('0x' + topics[2].hex()[-40:] if isinstance(topics[2], bytes) else '0x' + topics[2][-40:])
-    taker = Web3.to_checksum_address('0x' + topics[3].hex()[-40:] if isinstance(topics[3], bytes) else '0x' + topics[3][-40:])
+    maker = _checksum(_topic_address_lc(topics[2]))
+    if taker_lc is None:
+        taker_lc = _topic_address_lc(topics[3])
+    taker = _checksum(taker_lc)
     
     # 解析 data 部分 (非 indexed 参数)
-    data = log['data']
-    if isinstance(data, str):
-        data = data if data.startswith('0x') else '0x' + data
-        data_bytes = bytes.fromhex(data[2:])
-    else:
-        data_bytes = data
+    data_bytes = _log_data_bytes(log)
     
     # data 包含 5 个 uint256: makerAssetId, takerAssetId, makerAmountFilled, takerAmountFilled, fee
-    # 每个 uint256 是 32 bytes
-    maker_asset_id = int.from_bytes(data_bytes[0:32], 'big')
-    taker_asset_id = int.from_bytes(data_bytes[32:64], 'big')
-    maker_amount_filled = int.from_bytes(data_bytes[64:96], 'big')
-    taker_amount_filled = int.from_bytes(data_bytes[96:128], 'big')
-    fee = int.from_bytes(data_bytes[128:160], 'big')
+    # 每个 uint256 是 32 bytes，通过 memoryview 切片避免复制
+    data_view = memoryview(data_bytes)
+    if amounts is None:
+        (
+            maker_asset_id,
+            taker_asset_id,
+            maker_amount_filled,
+            taker_amount_filled,
+            fee
+        ) = [int.from_bytes(data_view[i:i + 32], 'big') for i in _ORDER_FILLED_DATA_OFFSETS]
+        price_micro = None
+    else:
+        maker_asset_id = int.from_bytes(data_view[0:32], 'big')
+        taker_asset_id = int.from_bytes(data_view[32:64], 'big')
+        maker_amount_filled, taker_amount_filled, fee, price_micro = amounts
     
     # 判断交易方向和计算价格
     # maker_asset_id == 0 表示 maker 出 USDC，买入 token (BUY)
@@ -108,71 +235,107 @@ def parse_order_filled_log(log: Dict[str, Any], exchange: str) -> Trade:
         side = "BUY"
         token_id = f"0x{taker_asset_id:064x}"
         # price = USDC / token
-        if taker_amount_filled > 0:
-            price = Decimal(maker_amount_filled) / Decimal(taker_amount_filled)
-        else:
-            price = Decimal(0)
+        if price_micro is None:
+            price_str = format_price(maker_amount_filled, taker_amount_filled)
     else:
         # maker 卖出 token，得到 USDC
         side = "SELL"
         token_id = f"0x{maker_asset_id:064x}"
         # price = USDC / token
-        if maker_amount_filled > 0:
-            price = Decimal(taker_amount_filled) / Decimal(maker_amount_filled)
-        else:
-            price = Decimal(0)
-    
-    # 格式化价格（保留合理精度）
-    price_str = f"{price:.6f}".rstrip('0').rstrip('.')
-    
-    return Trade(
-        tx_hash=log['transactionHash'].hex() if isinstance(log['transactionHash'], bytes) else log['transactionHash'],
-        log_index=log['logIndex'],
-        exchange=exchange,
-        order_hash=order_hash,
-        maker=maker,
-        taker=taker,
-        maker_asset_id=str(maker_asset_id),
-        taker_asset_id=str(taker_asset_id),
-        maker_amount=str(maker_amount_filled),
-        taker_amount=str(taker_amount_filled),
-        fee=str(fee),
-        price=price_str,
-        token_id=token_id,
-        side=side
+        if price_micro is None:
+            price_str = format_price(taker_amount_filled, maker_amount_filled)
+    
+    if price_micro is not None:
+        price_str = format_price_micro(price_micro)
+    
+    return (
+        log['transactionHash'].hex() if isinstance(log['transactionHash'], bytes) else log['transactionHash'],
+        log['logIndex'],
+        exchange,
+        order_hash,
+        maker,
+        taker,
+        str(maker_asset_id),
+        str(taker_asset_id),
+        str(maker_amount_filled),
+        str(taker_amount_filled),
+        str(fee),
+        price_str,
+        token_id,
+        side
     )
 
 
-def decode_transaction(w3: Web3, tx_hash: str) -> List[Trade]:
+def decode_transaction(
+    w3: Web3,
+    tx_hash: str,
+    receipt: Optional[Dict[str, Any]] = None
+) -> List[Trade]:
     """
     解码交易中的所有 OrderFilled 事件
     
     Args:
         w3: Web3 实例
         tx_hash: 交易哈希
+        receipt: 已获取的交易回执 (可选，避免重复请求)
     
     Returns:
         Trade 对象列表
     """
+    return list(decode_transaction_batch(w3, tx_hash, receipt))
+
+
+def decode_transaction_batch(
+    w3: Web3,
+    tx_hash: str,
+    receipt: Optional[Dict[str, Any]] = None
+) -> TradeBatch:
+    """
+    解码交易中的所有 OrderFilled 事件（列式结果，不逐条构造 Trade）
+    
+    Args:
+        w3: Web3 实例
+        tx_hash: 交易哈希
+        receipt: 已获取的交易回执 (可选，避免重复请求)
+    
+    Returns:
+        TradeBatch 对象
+    """
     # 获取交易回执
-    receipt = w3.eth.get_transaction_receipt(tx_hash)
+    if receipt is None:
+        receipt = get_transaction_receipt(w3, tx_hash)
+    
+    return decode_order_filled_logs(receipt['logs'])
+
+
+def decode_order_filled_logs(logs: Iterable[Dict[str, Any]]) -> TradeBatch:
+    """
+    批量解码 OrderFilled 日志（可用于跨交易的历史回填）
     
-    trades = []
+    非 Polymarket 交易所或非 OrderFilled 的日志会被跳过；
+    日志数量较多且安装了 numba 时，金额与价格走编译后的批量路径。
+    
+    Args:
+        logs: 日志列表
+    
+    Returns:
+        TradeBatch 对象
+    """
+    # 筛选出需要解析的 OrderFilled 日志: (log, exchange, taker_lc)
+    order_filled_logs = []
     
     # 遍历所有日志
-    for log in receipt['logs']:
+    for log in logs:
         # 检查是否是 Polymarket 交易所的日志
         log_address = log['address']
         
-        # 规范化地址格式
+        # 规范化为小写地址后直接查表
         if isinstance(log_address, str):
-            log_address = Web3.to_checksum_address(log_address)
+            address_lc = log_address.lower()
+        else:
+            address_lc = '0x' + bytes(log_address).hex()
         
-        exchange = None
-        if log_address == Web3.to_checksum_address(CTF_EXCHANGE):
-            exchange = CTF_EXCHANGE
-        elif log_address == Web3.to_checksum_address(NEGRISK_CTF_EXCHANGE):
-            exchange = NEGRISK_CTF_EXCHANGE
+        exchange = _EXCHANGE_BY_ADDRESS_LC.get(address_lc)
         
         if exchange is None:
             continue
@@ -182,29 +345,44 @@ def decode_transaction(w3: Web3, tx_hash: str) -> List[Trade]:
             continue
         
         topic0 = log['topics'][0]
-        topic0_hex = topic0.hex() if isinstance(topic0, bytes) else topic0
+        if isinstance(topic0, str):
+            topic0 = bytes.fromhex(topic0[2:] if topic0.startswith('0x') else topic0)
         
-        if topic0_hex.lower() != ORDER_FILLED_TOPIC.lower():
+        if topic0 != ORDER_FILLED_TOPIC_BYTES:
             continue
         
         # 过滤掉 taker == exchange 的重复日志
         topics = log['topics']
-        taker_address = '0x' + (topics[3].hex()[-40:] if isinstance(topics[3], bytes) else topics[3][-40:])
-        taker_address = Web3.to_checksum_address(taker_address)
+        taker_address_lc = _topic_address_lc(topics[3])
         
         # 跳过 taker 是交易所合约自己的日志（避免重复计数）
-        if taker_address.lower() == exchange.lower():
+        if taker_address_lc == address_lc:
             continue
         
+        order_filled_logs.append((log, exchange, taker_address_lc))
+    
+    # 日志较多时，金额与价格通过 JIT 批量解析
+    batch_amounts = None
+    if len(order_filled_logs) > BATCH_THRESHOLD:
+        try:
+            batch_amounts = decode_amounts_batch(
+                [_log_data_bytes(log) for log, _, _ in order_filled_logs]
+            )
+        except Exception as e:
+            print(f"Batch decode failed, falling back: {e}", file=sys.stderr)
+    
+    rows = []
+    for i, (log, exchange, taker_address_lc) in enumerate(order_filled_logs):
+        amounts = batch_amounts[i] if batch_amounts is not None else None
+        
         # 解析日志
         try:
-            trade = parse_order_filled_log(log, exchange)
-            trades.append(trade)
+            rows.append(_parse_order_filled_row(log, exchange, taker_address_lc, amounts))
         except Exception as e:
             print(f"Error parsing log at index {log['logIndex']}: {e}", file=sys.stderr)
             continue
     
-    return trades
+    return TradeBatch(rows)
 
 
 def main():
@@ -221,7 +399,7 @@ def main():
         
         # 解码交易
         print(f"Decoding transaction: {args.tx_hash}", file=sys.stderr)
-        trades = decode_transaction(w3, args.tx_hash)
+        trades = decode_transaction_batch(w3, args.tx_hash)
         
         if not trades:
             print(f"No OrderFilled events found in transaction {args.tx_hash}", file=sys.stderr)
@@ -230,20 +408,19 @@ def main():
         print(f"Found {len(trades)} trade(s)", file=sys.stderr)
         
         # 转换为字典列表
-        trades_dict = [asdict(trade) for trade in trades]
+        trades_dict = trades.to_dicts()
         
         # 输出结果
-        output_json = json.dumps(trades_dict, indent=2)
-        
         if args.output:
             # 创建输出目录
             os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
             
             with open(args.output, 'w') as f:
-                f.write(output_json)
+                write_json(trades_dict, f)
             print(f"Results written to {args.output}", file=sys.stderr)
         else:
-            print(output_json)
+            write_json(trades_dict, sys.stdout)
+            sys.stdout.write("\n")
         
     except Exception as e:
         print(f"Error: {e}", file=sys.stderr)
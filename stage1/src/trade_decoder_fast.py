@@ -0,0 +1,137 @@
+"""
+Trade Decoder 批量快速路径
+
+使用 Numba JIT 批量解析 OrderFilled 日志 data 中的金额字段并计算价格。
+numpy / numba 为可选依赖，未安装时 NUMBA_AVAILABLE 为 False，调用方应回退到逐条解析。
+"""
+
+from typing import List, Optional, Tuple
+
+try:
+    import numpy as np
+    from numba import njit
+except ImportError:  # numpy / numba 为可选依赖
+    np = None
+    njit = None
+
+
+NUMBA_AVAILABLE = njit is not None
+
+# 日志数量超过该阈值时才走批量路径（JIT 调用本身有固定开销）
+BATCH_THRESHOLD = 32
+
+# OrderFilled data 长度：5 个 uint256
+ORDER_FILLED_DATA_SIZE = 160
+
+
+if NUMBA_AVAILABLE:
+    @njit(cache=True)
+    def _read_u64(data, i, offset):
+        """读取 uint256 字段的低 64 位"""
+        value = np.uint64(0)
+        for b in range(offset + 24, offset + 32):
+            value = (value << np.uint64(8)) | np.uint64(data[i, b])
+        return value
+
+    @njit(cache=True)
+    def _high_bytes_zero(data, i, offset):
+        """uint256 字段高 24 字节是否全为 0（即可装入 uint64）"""
+        for b in range(offset, offset + 24):
+            if data[i, b] != 0:
+                return False
+        return True
+
+    @njit(cache=True)
+    def _decode_batch(data):
+        """
+        批量解析 N x 160 字节的 OrderFilled data
+
+        Returns:
+            (maker_amount, taker_amount, fee, price_micro, ok) 五个数组；
+            ok 为 False 的行存在溢出，需回退到 Python 解析
+        """
+        n = data.shape[0]
+        maker_amount = np.zeros(n, np.uint64)
+        taker_amount = np.zeros(n, np.uint64)
+        fee = np.zeros(n, np.uint64)
+        price_micro = np.zeros(n, np.uint64)
+        ok = np.zeros(n, np.bool_)
+        max_usdc = np.uint64(18446744073709551615 // 1000000)
+
+        for i in range(n):
+            if not (_high_bytes_zero(data, i, 64)
+                    and _high_bytes_zero(data, i, 96)
+                    and _high_bytes_zero(data, i, 128)):
+                continue
+
+            maker = _read_u64(data, i, 64)
+            taker = _read_u64(data, i, 96)
+            maker_amount[i] = maker
+            taker_amount[i] = taker
+            fee[i] = _read_u64(data, i, 128)
+
+            # makerAssetId == 0 表示 BUY：price = maker / taker，否则 price = taker / maker
+            is_buy = True
+            for b in range(32):
+                if data[i, b] != 0:
+                    is_buy = False
+                    break
+            if is_buy:
+                usdc = maker
+                token = taker
+            else:
+                usdc = taker
+                token = maker
+
+            if token == 0:
+                ok[i] = True
+                continue
+            if usdc > max_usdc:
+                continue
+
+            scaled = usdc * np.uint64(1000000)
+            q = scaled // token
+            r = scaled - q * token
+            # 四舍六入五成双（r > token - r 等价于 2r > token，且不会溢出）
+            rest = token - r
+            if r > rest or (r == rest and (q & np.uint64(1)) == np.uint64(1)):
+                q += np.uint64(1)
+            price_micro[i] = q
+            ok[i] = True
+
+        return maker_amount, taker_amount, fee, price_micro, ok
+
+
+def decode_amounts_batch(
+    data_list: List[bytes]
+) -> Optional[List[Optional[Tuple[int, int, int, int]]]]:
+    """
+    批量解析 OrderFilled data 中的金额并计算价格
+
+    Args:
+        data_list: 每条日志的 data (bytes)
+
+    Returns:
+        与输入等长的列表，每项为 (maker_amount, taker_amount, fee, price_micro)，
+        price_micro 为价格乘以 10^6 后的整数；溢出的行为 None。
+        Numba 不可用或 data 长度不符合时返回 None
+    """
+    if not NUMBA_AVAILABLE or not data_list:
+        return None
+    if any(len(data) != ORDER_FILLED_DATA_SIZE for data in data_list):
+        return None
+
+    buffer = np.frombuffer(b''.join(data_list), dtype=np.uint8)
+    data = buffer.reshape(len(data_list), ORDER_FILLED_DATA_SIZE)
+    maker_amount, taker_amount, fee, price_micro, ok = _decode_batch(data)
+
+    return [
+        (maker, taker, fee_value, price) if row_ok else None
+        for maker, taker, fee_value, price, row_ok in zip(
+            maker_amount.tolist(),
+            taker_amount.tolist(),
+            fee.tolist(),
+            price_micro.tolist(),
+            ok.tolist()
+        )
+    ]
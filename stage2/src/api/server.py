@@ -5,33 +5,345 @@ API Server - 任务 C
 """
 
 import argparse
+import base64
+import binascii
+import functools
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager, contextmanager
 import sqlite3
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Iterator, Callable, Tuple, TypeVar
 
+import anyio
+import anyio.to_thread
 from fastapi import FastAPI, HTTPException, Query
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import JSONResponse
 import uvicorn
 
+try:
+    import orjson
+except ImportError:  # orjson 为可选依赖
+    orjson = None
+
 from src.db.store import (
     fetch_event_by_slug,
     fetch_market_by_slug,
     fetch_markets_by_event_id,
-    fetch_trades_for_market,
-    fetch_trades_for_token
+    fetch_trade_rows_for_market,
+    fetch_trade_rows_for_token,
+    sync_market_cache,
+    TRADE_COLUMNS
 )
+from src.db.migrate_blob_ids import has_text_trade_ids
+from src.db.pool import SQLitePool
+
+
+# 数据库路径通过环境变量传给各 worker 进程
+DB_PATH_ENV = "INDEXER_API_DB"
+
+# 全局数据库连接池（每个 worker 进程各自创建）
+db_pool: Optional[SQLitePool] = None
+
+# 等待空闲读连接的最长秒数，超时返回 503
+READ_ACQUIRE_TIMEOUT = 5.0
+
+# 线程池在读连接数之外多留的线程（数据版本查询等不占读连接的任务）
+THREADPOOL_HEADROOM = 4
+
+# 数据版本最多每隔这么多秒刷新一次（在线程池中执行 PRAGMA，不阻塞事件循环）
+DATA_VERSION_REFRESH_INTERVAL = 0.1
+
+# 最近一次读到的数据版本及其过期时间（time.monotonic()）
+_data_version: Any = None
+_data_version_expires = 0.0
 
+# 事件循环侧的读槽位，数量与读连接一致；超出的请求在此等待，超时返回 503
+_read_slots: Optional[anyio.Semaphore] = None
 
-app = FastAPI(title="Polymarket Indexer API", version="1.0.0")
 
-# 全局数据库连接
-db_conn: Optional[sqlite3.Connection] = None
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    worker 启动时创建连接池、退出时关闭
+    
+    SQLite 连接不能跨 fork 共享，因此连接池在每个 worker 进程内部初始化。
+    API 只读，连接池不打开写连接，数据库文件只读时也能启动。
+    读请求先在事件循环中获取读槽位（与读连接数一致），等待超时直接返回 503，
+    拿到槽位后线程池中必有空闲读连接；线程池比读连接数略大，不会成为排队点。
+    """
+    global db_pool, _read_slots, _data_version_expires
+    
+    db_path = os.environ.get(DB_PATH_ENV)
+    owns_pool = db_pool is None and db_path is not None
+    if owns_pool:
+        db_pool = SQLitePool(db_path, writable=False)
+    
+    if db_pool is not None:
+        # API 只读、不做迁移：文本形式的 token_id 按 BLOB 查询不到，/tokens/{id}/trades 结果会不完整
+        with db_pool.acquire_read() as conn:
+            if has_text_trade_ids(conn):
+                print("Warning: trades table has text token_id rows; run init_db or "
+                      "`python -m src.db.migrate_blob_ids` or token trade queries will miss them")
+        _read_slots = anyio.Semaphore(db_pool.size)
+        anyio.to_thread.current_default_thread_limiter().total_tokens = db_pool.size + THREADPOOL_HEADROOM
+    
+    yield
+    
+    _read_slots = None
+    _data_version_expires = 0.0
+    if owns_pool:
+        db_pool.close()
+        db_pool = None
 
 
-def get_db_connection() -> sqlite3.Connection:
-    """获取数据库连接"""
-    if db_conn is None:
+class ORJSONResponse(JSONResponse):
+    """使用 orjson（C 实现）序列化的 JSON 响应，未安装或遇到不支持的类型时回退到标准库"""
+    
+    def render(self, content: Any) -> bytes:
+        if orjson is not None:
+            try:
+                return orjson.dumps(content)
+            except TypeError:
+                # orjson 不支持超过 64 位的整数等类型
+                pass
+        return super().render(content)
+
+
+app = FastAPI(
+    title="Polymarket Indexer API",
+    version="1.0.0",
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
+)
+
+
+def get_db_pool() -> SQLitePool:
+    """获取数据库连接池"""
+    if db_pool is None:
         raise HTTPException(status_code=500, detail="Database not initialized")
-    return db_conn
+    return db_pool
+
+
+@contextmanager
+def acquire_read() -> Iterator[sqlite3.Connection]:
+    """借出一个只读连接，等待超过 READ_ACQUIRE_TIMEOUT 时返回 503"""
+    try:
+        with get_db_pool().acquire_read(timeout=READ_ACQUIRE_TIMEOUT) as conn:
+            yield conn
+    except queue.Empty:
+        raise HTTPException(status_code=503, detail="Database busy, retry later")
+
+
+def get_read_slots() -> anyio.Semaphore:
+    """获取读槽位信号量（未经 lifespan 初始化时按连接池大小创建）"""
+    global _read_slots
+    if _read_slots is None:
+        _read_slots = anyio.Semaphore(get_db_pool().size)
+    return _read_slots
+
+
+async def current_data_version() -> Any:
+    """
+    当前数据版本（缓存 DATA_VERSION_REFRESH_INTERVAL 秒，过期后在线程池中重新读取）
+    
+    刷新时顺带同步市场查询缓存，因此其它进程的写入最多延迟一个刷新间隔可见。
+    
+    Returns:
+        SQLitePool.data_version() 的返回值
+    """
+    global _data_version, _data_version_expires
+    
+    if time.monotonic() >= _data_version_expires:
+        version = await run_in_threadpool(get_db_pool().data_version)
+        _data_version = version
+        _data_version_expires = time.monotonic() + DATA_VERSION_REFRESH_INTERVAL
+        sync_market_cache(version)
+    return _data_version
+
+
+T = TypeVar("T")
+
+
+async def run_read(func: Callable[..., T], *args: Any, **kwargs: Any) -> T:
+    """
+    在线程池中借出只读连接并执行 func(conn, *args, **kwargs)，避免阻塞事件循环
+    
+    先在事件循环中等待读槽位，超过 READ_ACQUIRE_TIMEOUT 返回 503；
+    执行前按数据版本同步一次市场查询缓存（见 current_data_version，而不是每次查询）。
+    
+    Args:
+        func: 第一个参数为数据库连接的同步函数
+        
+    Returns:
+        func 的返回值
+    """
+    def call() -> T:
+        with acquire_read() as conn:
+            return func(conn, *args, **kwargs)
+    
+    await current_data_version()
+    slots = get_read_slots()
+    try:
+        with anyio.fail_after(READ_ACQUIRE_TIMEOUT):
+            await slots.acquire()
+    except TimeoutError:
+        raise HTTPException(status_code=503, detail="Database busy, retry later")
+    
+    try:
+        return await run_in_threadpool(call)
+    finally:
+        slots.release()
+
+
+# 响应缓存：TTL（秒）与最大条目数
+RESPONSE_CACHE_TTL = 60
+RESPONSE_CACHE_SIZE = 1024
+
+# key -> (过期时间, 数据版本, 响应)
+_response_cache: "OrderedDict[Tuple[Any, ...], Tuple[float, Any, Any]]" = OrderedDict()
+_response_cache_lock = threading.Lock()
+
+
+def cached_response(
+    ttl: float = RESPONSE_CACHE_TTL,
+    when: Optional[Callable[[Dict[str, Any]], bool]] = None
+):
+    """
+    进程内 TTL 响应缓存装饰器（按端点名 + 参数缓存）
+    
+    条目记录数据库的数据版本号，任何写入后旧条目失效（版本号最多延迟 DATA_VERSION_REFRESH_INTERVAL 秒）。
+    
+    Args:
+        ttl: 缓存有效期（秒）
+        when: 根据请求参数判断是否缓存（可选，默认总是缓存）
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(**kwargs):
+            if when is not None and not when(kwargs):
+                return await func(**kwargs)
+            
+            key = (func.__name__,) + tuple(sorted(kwargs.items()))
+            version = await current_data_version()
+            now = time.monotonic()
+            
+            with _response_cache_lock:
+                entry = _response_cache.get(key)
+                if entry is not None and entry[0] > now and entry[1] == version:
+                    _response_cache.move_to_end(key)
+                    return entry[2]
+            
+            result = await func(**kwargs)
+            
+            with _response_cache_lock:
+                _response_cache[key] = (now + ttl, version, result)
+                _response_cache.move_to_end(key)
+                while len(_response_cache) > RESPONSE_CACHE_SIZE:
+                    _response_cache.popitem(last=False)
+            
+            return result
+        
+        return wrapper
+    
+    return decorator
+
+
+def _is_block_bounded(params: Dict[str, Any]) -> bool:
+    """交易查询仅缓存指定了 toBlock 的历史区间（结果集不再增长）"""
+    return params.get("toBlock") is not None
+
+
+# 下一页游标的响应头（最后一页不返回）
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(block_number: int, log_index: int) -> str:
+    """将 (block_number, log_index) 编码为不透明的分页游标"""
+    return base64.urlsafe_b64encode(f"{block_number}:{log_index}".encode()).decode()
+
+
+def decode_cursor(cursor: Optional[str]) -> Optional[Tuple[int, int]]:
+    """
+    解析分页游标
+    
+    Args:
+        cursor: encode_cursor 生成的游标，为空或 "0" 表示从第一页开始
+        
+    Returns:
+        (block_number, log_index)，cursor 为空时返回 None
+        
+    Raises:
+        HTTPException: 游标格式错误时返回 400
+    """
+    # 兼容旧的偏移量写法：cursor=0 表示第一页
+    if not cursor or cursor == "0":
+        return None
+    try:
+        block_number, log_index = base64.urlsafe_b64decode(cursor.encode()).decode().split(":")
+        return int(block_number), int(log_index)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=400, detail=f"Invalid cursor: {cursor}")
+
+
+# 交易接口的响应格式：rows 为对象列表（默认），columnar 为列名 + 行数组
+TRADE_FORMAT_PATTERN = "^(rows|columnar)$"
+
+# 行元组中分页键的位置（见 TRADE_COLUMNS）
+_BLOCK_NUMBER_IDX = TRADE_COLUMNS.index('block_number')
+_LOG_INDEX_IDX = TRADE_COLUMNS.index('log_index')
+
+
+def paginate_trades(rows: List[Tuple[Any, ...]], limit: int, format: str = "rows") -> ORJSONResponse:
+    """
+    组装分页响应：取满一页时以最后一条记录生成下一页游标，通过 X-Next-Cursor 响应头返回
+    
+    Args:
+        rows: 当前页的交易记录元组（列顺序见 TRADE_COLUMNS）
+        limit: 每页条数
+        format: rows 返回交易对象列表；columnar 返回 {"columns": [...], "rows": [[...], ...]}，
+            不为每行重复列名
+        
+    Returns:
+        JSON 响应
+    """
+    headers = {}
+    if len(rows) == limit:
+        last = rows[-1]
+        headers[NEXT_CURSOR_HEADER] = encode_cursor(last[_BLOCK_NUMBER_IDX], last[_LOG_INDEX_IDX])
+    
+    if format == "columnar":
+        content = {"columns": TRADE_COLUMNS, "rows": rows}
+    else:
+        content = [dict(zip(TRADE_COLUMNS, row)) for row in rows]
+    
+    return ORJSONResponse(content=content, headers=headers)
+
+
+def _load_event_markets(conn: sqlite3.Connection, slug: str):
+    """在同一个读连接上查询事件及其市场列表"""
+    # 先获取事件
+    event = fetch_event_by_slug(conn, slug)
+    if not event:
+        raise HTTPException(status_code=404, detail=f"Event not found: {slug}")
+    
+    # 获取市场列表
+    markets = fetch_markets_by_event_id(conn, event['id'])
+    return event, markets
+
+
+def _load_market_trades(conn: sqlite3.Connection, slug: str, **kwargs: Any) -> List[Tuple[Any, ...]]:
+    """在同一个读连接上查询市场及其交易记录"""
+    # 先获取市场
+    market = fetch_market_by_slug(conn, slug)
+    if not market:
+        raise HTTPException(status_code=404, detail=f"Market not found: {slug}")
+    
+    # 获取交易记录
+    return fetch_trade_rows_for_market(conn, market_id=market['market_id'], **kwargs)
 
 
 @app.get("/")
@@ -51,6 +363,7 @@ async def root():
 
 
 @app.get("/events/{slug}")
+@cached_response()
 async def get_event(slug: str):
     """
     获取事件详情
@@ -61,8 +374,7 @@ async def get_event(slug: str):
     Returns:
         事件信息
     """
-    conn = get_db_connection()
-    event = fetch_event_by_slug(conn, slug)
+    event = await run_read(fetch_event_by_slug, slug)
     
     if not event:
         raise HTTPException(status_code=404, detail=f"Event not found: {slug}")
@@ -71,6 +383,7 @@ async def get_event(slug: str):
 
 
 @app.get("/events/{slug}/markets")
+@cached_response()
 async def get_event_markets(slug: str):
     """
     获取事件下的所有市场
@@ -81,15 +394,7 @@ async def get_event_markets(slug: str):
     Returns:
         市场列表
     """
-    conn = get_db_connection()
-    
-    # 先获取事件
-    event = fetch_event_by_slug(conn, slug)
-    if not event:
-        raise HTTPException(status_code=404, detail=f"Event not found: {slug}")
-    
-    # 获取市场列表
-    markets = fetch_markets_by_event_id(conn, event['id'])
+    event, markets = await run_read(_load_event_markets, slug)
     
     return {
         "event_slug": slug,
@@ -100,6 +405,7 @@ async def get_event_markets(slug: str):
 
 
 @app.get("/markets/{slug}")
+@cached_response()
 async def get_market(slug: str):
     """
     获取市场详情
@@ -110,8 +416,7 @@ async def get_market(slug: str):
     Returns:
         市场信息
     """
-    conn = get_db_connection()
-    market = fetch_market_by_slug(conn, slug)
+    market = await run_read(fetch_market_by_slug, slug)
     
     if not market:
         raise HTTPException(status_code=404, detail=f"Market not found: {slug}")
@@ -120,12 +425,14 @@ async def get_market(slug: str):
 
 
 @app.get("/markets/{slug}/trades")
+@cached_response(when=_is_block_bounded)
 async def get_market_trades(
     slug: str,
     limit: int = Query(default=100, ge=1, le=1000),
-    cursor: int = Query(default=0, ge=0),
+    cursor: Optional[str] = Query(default=None),
     fromBlock: Optional[int] = Query(default=None, ge=0),
-    toBlock: Optional[int] = Query(default=None, ge=0)
+    toBlock: Optional[int] = Query(default=None, ge=0),
+    format: str = Query(default="rows", pattern=TRADE_FORMAT_PATTERN)
 ):
     """
     获取市场的交易记录（分页）
@@ -133,40 +440,37 @@ async def get_market_trades(
     Args:
         slug: 市场 slug
         limit: 返回条数限制 (1-1000)
-        cursor: 分页偏移量
+        cursor: 分页游标（上一页响应的 X-Next-Cursor，可选）
         fromBlock: 起始区块（可选）
         toBlock: 结束区块（可选）
+        format: 响应格式 rows / columnar（可选）
         
     Returns:
-        交易记录列表
+        交易记录列表（下一页游标见 X-Next-Cursor 响应头）
     """
-    conn = get_db_connection()
+    after = decode_cursor(cursor)
     
-    # 先获取市场
-    market = fetch_market_by_slug(conn, slug)
-    if not market:
-        raise HTTPException(status_code=404, detail=f"Market not found: {slug}")
-    
-    # 获取交易记录
-    trades = fetch_trades_for_market(
-        conn=conn,
-        market_id=market['market_id'],
+    rows = await run_read(
+        _load_market_trades,
+        slug,
         limit=limit,
-        cursor=cursor,
+        after=after,
         from_block=fromBlock,
         to_block=toBlock
     )
     
-    return trades
+    return paginate_trades(rows, limit, format)
 
 
 @app.get("/tokens/{token_id}/trades")
+@cached_response(when=_is_block_bounded)
 async def get_token_trades(
     token_id: str,
     limit: int = Query(default=100, ge=1, le=1000),
-    cursor: int = Query(default=0, ge=0),
+    cursor: Optional[str] = Query(default=None),
     fromBlock: Optional[int] = Query(default=None, ge=0),
-    toBlock: Optional[int] = Query(default=None, ge=0)
+    toBlock: Optional[int] = Query(default=None, ge=0),
+    format: str = Query(default="rows", pattern=TRADE_FORMAT_PATTERN)
 ):
     """
     按 TokenId 获取交易记录（分页）
@@ -174,26 +478,27 @@ async def get_token_trades(
     Args:
         token_id: Token ID
         limit: 返回条数限制 (1-1000)
-        cursor: 分页偏移量
+        cursor: 分页游标（上一页响应的 X-Next-Cursor，可选）
         fromBlock: 起始区块（可选）
         toBlock: 结束区块（可选）
+        format: 响应格式 rows / columnar（可选）
         
     Returns:
-        交易记录列表
+        交易记录列表（下一页游标见 X-Next-Cursor 响应头）
     """
-    conn = get_db_connection()
+    after = decode_cursor(cursor)
     
     # 获取交易记录
-    trades = fetch_trades_for_token(
-        conn=conn,
+    rows = await run_read(
+        fetch_trade_rows_for_token,
         token_id=token_id,
         limit=limit,
-        cursor=cursor,
+        after=after,
         from_block=fromBlock,
         to_block=toBlock
     )
     
-    return trades
+    return paginate_trades(rows, limit, format)
 
 
 @app.get("/health")
@@ -205,7 +510,8 @@ async def health_check():
 def start_server(
     db_path: str,
     host: str = "127.0.0.1",
-    port: int = 8000
+    port: int = 8000,
+    workers: int = 1
 ):
     """
     启动 API 服务器
@@ -214,17 +520,19 @@ def start_server(
         db_path: 数据库文件路径
         host: 监听地址
         port: 监听端口
+        workers: worker 进程数（大于 1 时以多进程运行，分摊 JSON 序列化的 CPU 开销）
     """
-    global db_conn
-    
-    # 初始化数据库连接
-    db_conn = sqlite3.connect(db_path, check_same_thread=False)
+    # 连接池由各 worker 在启动时根据该环境变量创建
+    os.environ[DB_PATH_ENV] = db_path
     
-    print(f"Starting API server on {host}:{port}")
+    print(f"Starting API server on {host}:{port} ({workers} worker(s))")
     print(f"Database: {db_path}")
     
-    # 启动服务器
-    uvicorn.run(app, host=host, port=port)
+    # 启动服务器（多 worker 需要以导入字符串的形式传入 app）
+    if workers > 1:
+        uvicorn.run("src.api.server:app", host=host, port=port, workers=workers)
+    else:
+        uvicorn.run(app, host=host, port=port)
 
 
 if __name__ == "__main__":
@@ -232,7 +540,8 @@ if __name__ == "__main__":
     parser.add_argument("--db", required=True, help="Database file path")
     parser.add_argument("--host", default="127.0.0.1", help="Host address")
     parser.add_argument("--port", type=int, default=8000, help="Port number")
+    parser.add_argument("--workers", type=int, default=1, help="Number of worker processes")
     
     args = parser.parse_args()
     
-    start_server(db_path=args.db, host=args.host, port=args.port)
+    start_server(db_path=args.db, host=args.host, port=args.port, workers=args.workers)
@@ -5,9 +5,24 @@ CTF Token ID Derivation
 """
 
 from dataclasses import dataclass
+from functools import lru_cache
 from typing import Optional
-from web3 import Web3
-from eth_abi import encode
+from eth_hash.auto import keccak as _keccak
+
+
+# 常用 indexSet 的 uint256 编码（YES = 1, NO = 2）
+_IDX1 = (1).to_bytes(32, 'big')
+_IDX2 = (2).to_bytes(32, 'big')
+_INDEX_SET_BYTES = {1: _IDX1, 2: _IDX2}
+
+# abi.encode 中 address 左侧补齐的 12 个零字节
+_ADDRESS_PADDING = bytes(12)
+
+# 默认的父集合 ID（顶层集合）
+ZERO_COLLECTION_ID = "0x" + "00" * 32
+
+# 派生结果缓存容量：同一市场在索引过程中会被反复派生
+DERIVE_CACHE_SIZE = 65536
 
 
 @dataclass(frozen=True)
@@ -19,6 +34,38 @@ class BinaryPositions:
     collection_no: str   # NO Collection ID (hex string)
 
 
+def _hex_to_bytes(value: str, size: int) -> bytes:
+    """将 hex string（可带 0x 前缀）左侧补零后转为定长 bytes"""
+    if value.startswith('0x'):
+        value = value[2:]
+    return bytes.fromhex(value.zfill(size * 2))
+
+
+def _address_to_bytes(address: str) -> bytes:
+    """将地址转为 20 字节，长度不符时抛出 ValueError"""
+    address_bytes = bytes.fromhex(address[2:] if address.startswith('0x') else address)
+    if len(address_bytes) != 20:
+        raise ValueError(f"Invalid address: {address}")
+    return address_bytes
+
+
+def _get_collection_id_b(parent: bytes, cond: bytes, index_set: int) -> bytes:
+    """collectionId = keccak256(abi.encodePacked(bytes32, bytes32, uint256))"""
+    index_bytes = _INDEX_SET_BYTES.get(index_set) or index_set.to_bytes(32, 'big')
+    return _keccak(parent + cond + index_bytes)
+
+
+def _get_position_id_b(collateral: bytes, collection: bytes) -> bytes:
+    """positionId = keccak256(abi.encodePacked(address, bytes32))"""
+    return _keccak(collateral + collection)
+
+
+def _get_condition_id_b(oracle: bytes, question: bytes, outcome_slot_count: int) -> bytes:
+    """conditionId = keccak256(abi.encode(address, bytes32, uint256))"""
+    return _keccak(_ADDRESS_PADDING + oracle + question + outcome_slot_count.to_bytes(32, 'big'))
+
+
+@lru_cache(maxsize=DERIVE_CACHE_SIZE)
 def get_collection_id(
     parent_collection_id: str,
     condition_id: str,
@@ -37,24 +84,14 @@ def get_collection_id(
     Returns:
         Collection ID (hex string, 0x + 64 chars)
     """
-    # 确保输入格式正确
-    if not parent_collection_id.startswith('0x'):
-        parent_collection_id = '0x' + parent_collection_id
-    if not condition_id.startswith('0x'):
-        condition_id = '0x' + condition_id
-    
-    # 将 hex string 转为 bytes32
-    parent_bytes = bytes.fromhex(parent_collection_id[2:].zfill(64))
-    condition_bytes = bytes.fromhex(condition_id[2:].zfill(64))
-    
-    # 编码参数并计算哈希
-    # abi.encodePacked(bytes32, bytes32, uint256)
-    packed = parent_bytes + condition_bytes + index_set.to_bytes(32, 'big')
-    collection_id = Web3.keccak(packed)
-    
-    return '0x' + collection_id.hex()
+    return '0x' + _get_collection_id_b(
+        _hex_to_bytes(parent_collection_id, 32),
+        _hex_to_bytes(condition_id, 32),
+        index_set
+    ).hex()
 
 
+@lru_cache(maxsize=DERIVE_CACHE_SIZE)
 def get_position_id(
     collateral_token: str,
     collection_id: str
@@ -71,24 +108,13 @@ def get_position_id(
     Returns:
         Position ID (hex string, 0x + 64 chars)
     """
-    # 确保地址格式正确
-    if not collateral_token.startswith('0x'):
-        collateral_token = '0x' + collateral_token
-    if not collection_id.startswith('0x'):
-        collection_id = '0x' + collection_id
-    
-    # 将地址转为 bytes20，collection_id 转为 bytes32
-    token_bytes = bytes.fromhex(collateral_token[2:].zfill(40))
-    collection_bytes = bytes.fromhex(collection_id[2:].zfill(64))
-    
-    # abi.encodePacked(address, bytes32)
-    # address is 20 bytes, bytes32 is 32 bytes
-    packed = token_bytes + collection_bytes
-    position_id = Web3.keccak(packed)
-    
-    return '0x' + position_id.hex()
+    return '0x' + _get_position_id_b(
+        _hex_to_bytes(collateral_token, 20),
+        _hex_to_bytes(collection_id, 32)
+    ).hex()
 
 
+@lru_cache(maxsize=DERIVE_CACHE_SIZE)
 def get_condition_id(
     oracle: str,
     question_id: str,
@@ -107,33 +133,20 @@ def get_condition_id(
     Returns:
         Condition ID (hex string, 0x + 64 chars)
     """
-    # 确保格式正确
-    if not oracle.startswith('0x'):
-        oracle = '0x' + oracle
-    if not question_id.startswith('0x'):
-        question_id = '0x' + question_id
-    
-    # 使用 eth_abi 编码参数
-    # abi.encode(address, bytes32, uint256)
-    encoded = encode(
-        ['address', 'bytes32', 'uint256'],
-        [
-            Web3.to_checksum_address(oracle),
-            bytes.fromhex(question_id[2:].zfill(64)),
-            outcome_slot_count
-        ]
-    )
-    
-    condition_id = Web3.keccak(encoded)
-    return '0x' + condition_id.hex()
+    return '0x' + _get_condition_id_b(
+        _address_to_bytes(oracle),
+        _hex_to_bytes(question_id, 32),
+        outcome_slot_count
+    ).hex()
 
 
+@lru_cache(maxsize=DERIVE_CACHE_SIZE)
 def derive_binary_positions(
     oracle: str,
     question_id: str,
     collateral_token: str,
     condition_id: Optional[str] = None,
-    parent_collection_id: str = "0x0000000000000000000000000000000000000000000000000000000000000000"
+    parent_collection_id: str = ZERO_COLLECTION_ID
 ) -> BinaryPositions:
     """
     为二元市场计算 YES 和 NO 两个头寸的 Token ID
@@ -150,23 +163,27 @@ def derive_binary_positions(
     """
     # 如果没有提供 condition_id，则计算它
     if condition_id is None:
-        condition_id = get_condition_id(oracle, question_id, 2)
+        cond = _get_condition_id_b(_address_to_bytes(oracle), _hex_to_bytes(question_id, 32), 2)
+    else:
+        cond = _hex_to_bytes(condition_id, 32)
     
-    # 计算 YES 和 NO 的 Collection ID
+    # YES / NO 共用同一个 (parentCollectionId, conditionId) 前缀
     # YES: indexSet = 1 (0b01)
     # NO: indexSet = 2 (0b10)
-    collection_yes = get_collection_id(parent_collection_id, condition_id, 1)
-    collection_no = get_collection_id(parent_collection_id, condition_id, 2)
+    prefix = _hex_to_bytes(parent_collection_id, 32) + cond
+    collection_yes = _keccak(prefix + _IDX1)
+    collection_no = _keccak(prefix + _IDX2)
     
     # 计算 YES 和 NO 的 Position ID (Token ID)
-    position_yes = get_position_id(collateral_token, collection_yes)
-    position_no = get_position_id(collateral_token, collection_no)
+    collateral = _hex_to_bytes(collateral_token, 20)
+    position_yes = _get_position_id_b(collateral, collection_yes)
+    position_no = _get_position_id_b(collateral, collection_no)
     
     return BinaryPositions(
-        position_yes=position_yes,
-        position_no=position_no,
-        collection_yes=collection_yes,
-        collection_no=collection_no
+        position_yes='0x' + position_yes.hex(),
+        position_no='0x' + position_no.hex(),
+        collection_yes='0x' + collection_yes.hex(),
+        collection_no='0x' + collection_no.hex()
     )
 
 
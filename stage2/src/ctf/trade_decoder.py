@@ -4,20 +4,28 @@ Trade Decoder
 解析 Polymarket 链上交易日志。
 """
 
+import sys
 from dataclasses import dataclass
-from decimal import Decimal
-from typing import Dict, Any
+from functools import lru_cache
+from typing import Dict, Any, List, Optional, Tuple, Union
+from eth_utils import to_checksum_address
 from web3 import Web3
 
+from src.ctf.trade_decoder_fast import BATCH_THRESHOLD, decode_amounts_batch
+
 # Polymarket 交易所合约地址
 CTF_EXCHANGE = "0x4bFb41d5B3570DeFd03C39a9A4D8dE6Bd8B8982E"  # 普通二元市场
 NEGRISK_CTF_EXCHANGE = "0xC5d563A36AE78145C45a50134d48A1215220f80a"  # 负风险市场
+_CTF_EXCHANGE_CS = to_checksum_address(CTF_EXCHANGE)
+_NEGRISK_CS = to_checksum_address(NEGRISK_CTF_EXCHANGE)
 
 # OrderFilled 事件签名
 # event OrderFilled(bytes32 indexed orderHash, address indexed maker, address indexed taker, 
 #                   uint256 makerAssetId, uint256 takerAssetId, uint256 makerAmountFilled,
 #                   uint256 takerAmountFilled, uint256 fee)
-ORDER_FILLED_TOPIC = '0x' + Web3.keccak(text="OrderFilled(bytes32,address,address,uint256,uint256,uint256,uint256,uint256)").hex()
+# 以 32 字节 bytes 保存，直接与日志的 topics[0]（HexBytes）比较，无需逐条 .hex()
+ORDER_FILLED_TOPIC_BYTES = bytes(Web3.keccak(text="OrderFilled(bytes32,address,address,uint256,uint256,uint256,uint256,uint256)"))
+ORDER_FILLED_TOPIC = '0x' + ORDER_FILLED_TOPIC_BYTES.hex()
 
 
 @dataclass(frozen=True)
@@ -39,55 +47,156 @@ class Trade:
     side: str
 
 
-def decode_order_filled(log: Dict[str, Any]) -> Trade:
+# 校验和地址缓存容量（头部做市商地址高度重复）
+CHECKSUM_CACHE_SIZE = 65536
+
+
+@lru_cache(maxsize=CHECKSUM_CACHE_SIZE)
+def _cs_addr(address: Union[str, bytes]) -> str:
+    """
+    带缓存的 EIP-55 校验和地址（同一批交易中 maker/taker 大量重复）
+    
+    Args:
+        address: 0x 十六进制地址字符串或 20 字节地址
+    
+    Returns:
+        校验和地址
+    """
+    return to_checksum_address(address)
+
+
+def format_price(usdc_amount: int, token_amount: int) -> str:
+    """
+    用整数定点运算计算价格字符串（保留 6 位小数，去掉末尾 0）
+    
+    Args:
+        usdc_amount: USDC 数量
+        token_amount: Token 数量
+    
+    Returns:
+        价格字符串，token_amount 为 0 时返回 "0"
+    """
+    if token_amount <= 0:
+        return "0"
+    
+    q, r = divmod(usdc_amount * 1_000_000, token_amount)
+    # 与 Decimal 格式化一致，采用四舍六入五成双
+    if 2 * r > token_amount or (2 * r == token_amount and q & 1):
+        q += 1
+    
+    return format_price_micro(q)
+
+
+def format_price_micro(price_micro: int) -> str:
+    """将放大 10^6 倍的整数价格格式化为字符串（去掉末尾 0）"""
+    whole, frac = divmod(price_micro, 1_000_000)
+    return f"{whole}.{frac:06d}".rstrip('0').rstrip('.')
+
+
+def _topic_bytes(topic: Any) -> bytes:
+    """将 topic 统一为 bytes（HexBytes 原样返回，十六进制字符串解码）"""
+    if isinstance(topic, bytes):
+        return topic
+    return bytes.fromhex(topic[2:] if topic.startswith('0x') else topic)
+
+
+def is_order_filled_log(log: Dict[str, Any]) -> bool:
+    """
+    判断日志是否为 OrderFilled 事件
+    
+    Args:
+        log: Web3 日志对象
+    
+    Returns:
+        topics[0] 与 OrderFilled 事件签名一致时返回 True
+    """
+    topics = log['topics']
+    return bool(topics) and _topic_bytes(topics[0]) == ORDER_FILLED_TOPIC_BYTES
+
+
+# 32 字节全零字（makerAssetId == 0 表示 maker 出 USDC）
+_ZERO_WORD = bytes(32)
+
+
+def _log_data_bytes(log: Dict[str, Any]) -> bytes:
+    """获取日志 data 的 bytes 形式"""
+    data = log['data']
+    if isinstance(data, str):
+        data = data if data.startswith('0x') else '0x' + data
+        return bytes.fromhex(data[2:])
+    return data
+
+
+def order_filled_token_bytes(log: Dict[str, Any]) -> bytes:
+    """
+    不做完整解码，直接从 OrderFilled data 中取出头寸 token ID（32 字节大端），用于解码前的过滤
+    
+    Args:
+        log: Web3 日志对象
+    
+    Returns:
+        makerAssetId 为 0（BUY）时为 takerAssetId，否则为 makerAssetId
+    """
+    data = _log_data_bytes(log)
+    maker_asset_id = data[0:32]
+    return data[32:64] if maker_asset_id == _ZERO_WORD else maker_asset_id
+
+
+def decode_order_filled(
+    log: Dict[str, Any],
+    amounts: Optional[Tuple[int, int, int, int]] = None
+) -> Trade:
     """
     解析 OrderFilled 日志
     
     Args:
         log: Web3 日志对象
+        amounts: 批量路径已解析的 (maker_amount, taker_amount, fee, price_micro) (可选)
     
     Returns:
         Trade 对象
     """
-    # 确定交易所地址
+    # 日志字段各只读取一次（web3 的 AttributeDict 取值比普通 dict 慢）
     log_address = log['address']
+    tx_hash = log['transactionHash']
+    
+    # 确定交易所地址
     if isinstance(log_address, str):
-        log_address = Web3.to_checksum_address(log_address)
+        log_address = _cs_addr(log_address)
     
     exchange = None
-    if log_address == Web3.to_checksum_address(CTF_EXCHANGE):
+    if log_address == _CTF_EXCHANGE_CS:
         exchange = CTF_EXCHANGE
-    elif log_address == Web3.to_checksum_address(NEGRISK_CTF_EXCHANGE):
+    elif log_address == _NEGRISK_CS:
         exchange = NEGRISK_CTF_EXCHANGE
     else:
         exchange = str(log_address)
     
-    # 提取 topics
-    topics = log['topics']
+    # 提取 topics（入口处统一为 bytes，后续只做字节运算）
+    topics = [_topic_bytes(topic) for topic in log['topics']]
     
     # topic[0] 是事件签名
     # topic[1] 是 orderHash (indexed)
     # topic[2] 是 maker (indexed)
     # topic[3] 是 taker (indexed)
-    order_hash = topics[1].hex() if isinstance(topics[1], bytes) else topics[1]
-    maker = Web3.to_checksum_address('0x' + topics[2].hex()[-40:] if isinstance(topics[2], bytes) else '0x' + topics[2][-40:])
-    taker = Web3.to_checksum_address('0x' + topics[3].hex()[-40:] if isinstance(topics[3], bytes) else '0x' + topics[3][-40:])
+    order_hash = topics[1].hex()
+    maker = _cs_addr(bytes(topics[2][-20:]))
+    taker = _cs_addr(bytes(topics[3][-20:]))
     
     # 解析 data 部分 (非 indexed 参数)
-    data = log['data']
-    if isinstance(data, str):
-        data = data if data.startswith('0x') else '0x' + data
-        data_bytes = bytes.fromhex(data[2:])
-    else:
-        data_bytes = data
+    data_bytes = _log_data_bytes(log)
     
     # data 包含 5 个 uint256: makerAssetId, takerAssetId, makerAmountFilled, takerAmountFilled, fee
     # 每个 uint256 是 32 bytes
     maker_asset_id = int.from_bytes(data_bytes[0:32], 'big')
     taker_asset_id = int.from_bytes(data_bytes[32:64], 'big')
-    maker_amount_filled = int.from_bytes(data_bytes[64:96], 'big')
-    taker_amount_filled = int.from_bytes(data_bytes[96:128], 'big')
-    fee = int.from_bytes(data_bytes[128:160], 'big')
+    if amounts is None:
+        maker_amount_filled = int.from_bytes(data_bytes[64:96], 'big')
+        taker_amount_filled = int.from_bytes(data_bytes[96:128], 'big')
+        fee = int.from_bytes(data_bytes[128:160], 'big')
+        price_micro = None
+    else:
+        maker_amount_filled, taker_amount_filled, fee, price_micro = amounts
     
     # 判断交易方向和计算价格
     # maker_asset_id == 0 表示 maker 出 USDC，买入 token (BUY)
@@ -96,26 +205,21 @@ def decode_order_filled(log: Dict[str, Any]) -> Trade:
         # maker 用 USDC 买 token
         side = "BUY"
         token_id = f"0x{taker_asset_id:064x}"
-        # price = USDC / token
-        if taker_amount_filled > 0:
-            price = Decimal(maker_amount_filled) / Decimal(taker_amount_filled)
-        else:
-            price = Decimal(0)
+        usdc_amount, token_amount = maker_amount_filled, taker_amount_filled
     else:
         # maker 卖出 token，得到 USDC
         side = "SELL"
         token_id = f"0x{maker_asset_id:064x}"
-        # price = USDC / token
-        if maker_amount_filled > 0:
-            price = Decimal(taker_amount_filled) / Decimal(maker_amount_filled)
-        else:
-            price = Decimal(0)
+        usdc_amount, token_amount = taker_amount_filled, maker_amount_filled
     
-    # 格式化价格（保留合理精度）
-    price_str = f"{price:.6f}".rstrip('0').rstrip('.')
+    # price = USDC / token，格式化价格（保留合理精度）
+    if price_micro is not None:
+        price_str = format_price_micro(price_micro)
+    else:
+        price_str = format_price(usdc_amount, token_amount)
     
     return Trade(
-        tx_hash=log['transactionHash'].hex() if isinstance(log['transactionHash'], bytes) else log['transactionHash'],
+        tx_hash=tx_hash.hex() if isinstance(tx_hash, bytes) else tx_hash,
         log_index=log['logIndex'],
         exchange=exchange,
         order_hash=order_hash,
@@ -130,3 +234,30 @@ def decode_order_filled(log: Dict[str, Any]) -> Trade:
         token_id=token_id,
         side=side
     )
+
+
+def decode_order_filled_batch(logs: List[Dict[str, Any]]) -> List[Trade]:
+    """
+    批量解析 OrderFilled 日志（用于区块范围回填）
+    
+    日志数量超过 BATCH_THRESHOLD 且 Numba 可用时，金额与价格由 JIT 内核批量计算；
+    溢出的行、批量内核出错及其余情况回退到逐条解析。
+    
+    Args:
+        logs: Web3 日志对象列表
+    
+    Returns:
+        与输入顺序一致的 Trade 列表
+    """
+    batch_amounts = None
+    if len(logs) > BATCH_THRESHOLD:
+        try:
+            batch_amounts = decode_amounts_batch([_log_data_bytes(log) for log in logs])
+        except Exception as e:
+            # JIT 编译 / 缓存加载等失败不应中断整批写入，回退到逐条解析
+            print(f"Batch decode failed, falling back: {e}", file=sys.stderr)
+    
+    if batch_amounts is None:
+        return [decode_order_filled(log) for log in logs]
+    
+    return [decode_order_filled(log, amounts) for log, amounts in zip(logs, batch_amounts)]
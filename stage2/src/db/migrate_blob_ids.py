@@ -0,0 +1,85 @@
+"""
+一次性迁移：将 trades 表中以文本存储的 order_hash / token_id 重新编码为 32 字节 BLOB
+
+init_db 打开旧数据库时会自动执行；也可以手动运行:
+    python -m src.db.migrate_blob_ids --db ./data/demo_indexer.db
+"""
+
+import argparse
+import sqlite3
+
+from src.db.schema import configure_connection
+from src.db.store import hex_id_to_blob, write_txn
+
+
+# 每批更新的行数
+MIGRATE_BATCH_SIZE = 5000
+
+
+def has_text_trade_ids(conn: sqlite3.Connection) -> bool:
+    """
+    trades 表中是否还有文本形式的 token_id
+
+    SQLite 中 TEXT 排在 BLOB 之前，按范围查询可直接走 token_id 索引，不必全表扫描。
+
+    Args:
+        conn: 数据库连接
+
+    Returns:
+        存在未迁移的行时为 True；尚未建 trades 表时为 False
+    """
+    table = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'trades'"
+    ).fetchone()
+    if table is None:
+        return False
+
+    row = conn.execute(
+        "SELECT 1 FROM trades WHERE token_id >= '' AND token_id < X'' LIMIT 1"
+    ).fetchone()
+    return row is not None
+
+
+def migrate_trade_ids(conn: sqlite3.Connection) -> int:
+    """
+    将 trades 表中文本形式的 order_hash / token_id 转为 BLOB（可重复执行）
+
+    Args:
+        conn: 数据库连接
+
+    Returns:
+        更新的行数
+    """
+    updated = 0
+    with write_txn(conn):
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT id, order_hash, token_id FROM trades
+            WHERE typeof(order_hash) = 'text' OR typeof(token_id) = 'text'
+        """)
+
+        while True:
+            rows = cursor.fetchmany(MIGRATE_BATCH_SIZE)
+            if not rows:
+                break
+
+            conn.executemany(
+                "UPDATE trades SET order_hash = ?, token_id = ? WHERE id = ?",
+                [(hex_id_to_blob(order_hash), hex_id_to_blob(token_id), trade_id)
+                 for trade_id, order_hash, token_id in rows]
+            )
+            updated += len(rows)
+
+    return updated
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-encode trade hex IDs as BLOB")
+    parser.add_argument("--db", required=True, help="Database file path")
+
+    args = parser.parse_args()
+
+    conn = configure_connection(sqlite3.connect(args.db))
+    count = migrate_trade_ids(conn)
+    print(f"Migrated {count} trades")
+    conn.close()
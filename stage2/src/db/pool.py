@@ -0,0 +1,123 @@
+"""
+SQLite 连接池
+
+一个专用写连接 + N 个只读连接。WAL 模式下读连接之间、读与写之间互不阻塞，
+避免所有请求共用一个连接而被 SQLite 内部互斥锁串行化。
+只读场景（如 API 服务）可以不打开写连接，数据库文件只读时也能启动。
+"""
+
+import os
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator, Optional, Tuple
+
+from src.db.schema import STATEMENT_CACHE_SIZE, configure_connection
+
+
+class SQLitePool:
+    """SQLite 双连接池（1 个写连接 + N 个读连接）"""
+
+    def __init__(self, db_path: str, readers: Optional[int] = None, writable: bool = True):
+        """
+        Args:
+            db_path: 数据库文件路径
+            readers: 读连接数量（默认 os.cpu_count()）
+            writable: 是否打开写连接（False 时只有读连接，acquire_write 不可用）
+        """
+        self.db_path = db_path
+        self.size = readers or os.cpu_count() or 4
+
+        # 写连接先打开：设置 WAL 并创建 -wal/-shm 文件，只读连接才能打开 WAL 数据库
+        # （只读池依赖写入方，如索引器，已将数据库设为 WAL）
+        # isolation_level=None 由 acquire_write 显式管理事务
+        self.writer: Optional[sqlite3.Connection] = None
+        if writable:
+            self.writer = sqlite3.connect(
+                db_path,
+                check_same_thread=False,
+                isolation_level=None,
+                cached_statements=STATEMENT_CACHE_SIZE
+            )
+            configure_connection(self.writer)
+        self._write_lock = threading.Lock()
+        self._write_count = 0
+
+        ro_uri = f"{Path(db_path).resolve().as_uri()}?mode=ro"
+        self.readers: "queue.Queue[sqlite3.Connection]" = queue.Queue(maxsize=self.size)
+        for _ in range(self.size):
+            conn = sqlite3.connect(
+                ro_uri,
+                uri=True,
+                check_same_thread=False,
+                isolation_level=None,
+                cached_statements=STATEMENT_CACHE_SIZE
+            )
+            configure_connection(conn, read_only=True)
+            self.readers.put(conn)
+
+        # 专用于 PRAGMA data_version 的连接：其它连接（含其它进程）提交后该值会变化
+        self._watcher = sqlite3.connect(ro_uri, uri=True, check_same_thread=False, isolation_level=None)
+        self._watcher_lock = threading.Lock()
+
+    @contextmanager
+    def acquire_read(self, timeout: Optional[float] = None) -> Iterator[sqlite3.Connection]:
+        """
+        借出一个只读连接，用完归还
+        
+        Args:
+            timeout: 等待空闲连接的秒数（默认一直等待），超时抛出 queue.Empty
+        """
+        conn = self.readers.get(timeout=timeout)
+        try:
+            yield conn
+        finally:
+            self.readers.put(conn)
+
+    @contextmanager
+    def acquire_write(self) -> Iterator[sqlite3.Connection]:
+        """
+        独占写连接并开启 BEGIN IMMEDIATE 事务，正常退出时提交，异常时回滚
+        
+        store 中的 upsert / update_sync_state / save_block_timestamps / bulk_insert_trades
+        都不提交，由本事务统一提交。
+        """
+        if self.writer is None:
+            raise RuntimeError(f"Connection pool is read-only: {self.db_path}")
+        with self._write_lock:
+            self.writer.execute("BEGIN IMMEDIATE")
+            try:
+                yield self.writer
+            except BaseException:
+                if self.writer.in_transaction:
+                    self.writer.execute("ROLLBACK")
+                raise
+            # store 中的写函数与 write_txn 都加入本事务、不自行提交；
+            # 仅当调用方在块内显式 COMMIT / ROLLBACK 时事务才已结束（与 write_txn 一致）
+            if self.writer.in_transaction:
+                self.writer.execute("COMMIT")
+            self._write_count += 1
+
+    def data_version(self) -> Tuple[int, int]:
+        """
+        数据版本号，任何写入（本进程的写连接或外部进程，如索引器）后都会变化
+        
+        Returns:
+            (PRAGMA data_version, 本池写事务计数)
+        """
+        with self._watcher_lock:
+            version = self._watcher.execute("PRAGMA data_version").fetchone()[0]
+        return version, self._write_count
+
+    def close(self) -> None:
+        """关闭所有连接"""
+        while True:
+            try:
+                self.readers.get_nowait().close()
+            except queue.Empty:
+                break
+        self._watcher.close()
+        if self.writer is not None:
+            self.writer.close()
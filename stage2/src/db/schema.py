@@ -9,6 +9,42 @@ from pathlib import Path
 from typing import Optional
 
 
+# WAL 让读写互不阻塞（写入数据库文件头，只读连接不能设置）
+JOURNAL_MODE_PRAGMA = "PRAGMA journal_mode=WAL"
+
+# 连接级 PRAGMA：synchronous=NORMAL 在 WAL 下仍保证一致性；
+# cache_size 为每个连接 64 MiB 的页缓存上限（按需分配）
+CONNECTION_PRAGMAS = """
+    PRAGMA synchronous=NORMAL;
+    PRAGMA busy_timeout=5000;
+    PRAGMA cache_size=-65536;
+    PRAGMA temp_store=MEMORY;
+    PRAGMA mmap_size=268435456;
+    PRAGMA foreign_keys=ON;
+"""
+
+
+# 每个连接的预编译语句缓存容量（sqlite3 默认 128）
+STATEMENT_CACHE_SIZE = 512
+
+
+def configure_connection(conn: sqlite3.Connection, read_only: bool = False) -> sqlite3.Connection:
+    """
+    为数据库连接应用 PRAGMA 调优（可重复调用，WAL 模式会持久化到文件）
+    
+    Args:
+        conn: 数据库连接
+        read_only: 是否为只读连接（跳过需要写文件的 journal_mode 设置）
+        
+    Returns:
+        同一个数据库连接对象
+    """
+    if not read_only:
+        conn.execute(JOURNAL_MODE_PRAGMA)
+    conn.executescript(CONNECTION_PRAGMAS)
+    return conn
+
+
 def init_db(db_path: str) -> sqlite3.Connection:
     """
     初始化数据库，创建所有必要的表
@@ -22,7 +58,9 @@ def init_db(db_path: str) -> sqlite3.Connection:
     # 确保目录存在
     Path(db_path).parent.mkdir(parents=True, exist_ok=True)
     
-    conn = sqlite3.Connection(db_path)
+    # isolation_level=None：驱动不再隐式 BEGIN / COMMIT，写事务由 store.write_txn 显式管理
+    conn = sqlite3.Connection(db_path, isolation_level=None, cached_statements=STATEMENT_CACHE_SIZE)
+    configure_connection(conn)
     cursor = conn.cursor()
     
     # 创建 events 表
@@ -77,6 +115,9 @@ def init_db(db_path: str) -> sqlite3.Connection:
     """)
     
     # 创建 trades 表
+    # order_hash / token_id 以 32 字节 BLOB 存储（写入见 store.hex_id_to_blob，
+    # 读取时由 store._SQL_TRADES_SELECT 中的 CASE typeof(...) 表达式还原为 0x 十六进制）；
+    # tx_hash 与 markets 表的 ID 保持文本，便于直接用 sqlite3 命令行核对
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS trades (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -86,14 +127,14 @@ def init_db(db_path: str) -> sqlite3.Connection:
             block_number INTEGER NOT NULL,
             timestamp TIMESTAMP NOT NULL,
             exchange VARCHAR(42) NOT NULL,
-            order_hash VARCHAR(66) NOT NULL,
+            order_hash BLOB NOT NULL,
             maker VARCHAR(42) NOT NULL,
             taker VARCHAR(42) NOT NULL,
             side VARCHAR(10) NOT NULL,
             outcome VARCHAR(10) NOT NULL,
             price VARCHAR(50) NOT NULL,
             size VARCHAR(50) NOT NULL,
-            token_id VARCHAR(78) NOT NULL,
+            token_id BLOB NOT NULL,
             maker_asset_id VARCHAR(78) NOT NULL,
             taker_asset_id VARCHAR(78) NOT NULL,
             maker_amount VARCHAR(50) NOT NULL,
@@ -106,33 +147,54 @@ def init_db(db_path: str) -> sqlite3.Connection:
     """)
     
     # 为 trades 表创建索引
+    # 复合索引按 (block_number, log_index) 有序，分页查询无需临时排序
     cursor.execute("""
-        CREATE INDEX IF NOT EXISTS idx_trades_market_id 
-        ON trades(market_id)
+        CREATE INDEX IF NOT EXISTS idx_trades_mkt_blk 
+        ON trades(market_id, block_number, log_index)
     """)
     cursor.execute("""
-        CREATE INDEX IF NOT EXISTS idx_trades_block_number 
-        ON trades(block_number)
+        CREATE INDEX IF NOT EXISTS idx_trades_tok_blk 
+        ON trades(token_id, block_number, log_index)
     """)
     cursor.execute("""
         CREATE INDEX IF NOT EXISTS idx_trades_timestamp 
         ON trades(timestamp)
     """)
-    cursor.execute("""
-        CREATE INDEX IF NOT EXISTS idx_trades_token_id 
-        ON trades(token_id)
-    """)
     
-    # 创建 sync_state 表
+    # 删除被复合索引取代的旧单列索引（已有数据库升级）
+    for index_name in ("idx_trades_market_id", "idx_trades_block_number", "idx_trades_token_id"):
+        cursor.execute(f"DROP INDEX IF EXISTS {index_name}")
+    
+    # 创建 sync_state 表（小表、按 key 频繁更新，WITHOUT ROWID 让主键即为 B-tree）
     cursor.execute("""
         CREATE TABLE IF NOT EXISTS sync_state (
             key VARCHAR(50) PRIMARY KEY,
             last_block INTEGER NOT NULL,
             updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        ) WITHOUT ROWID
+    """)
+    
+    # 创建 block_timestamps 表（索引器的区块时间戳缓存，重复运行时无需再请求 RPC）
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS block_timestamps (
+            block_number INTEGER PRIMARY KEY,
+            timestamp INTEGER NOT NULL
         )
     """)
     
     conn.commit()
+    
+    # 市场查询缓存是模块级的，不区分数据库；打开（或重置后重新打开）数据库时清空，
+    # 避免沿用其它数据库或上次运行留下的条目（函数内导入避免循环依赖）
+    from src.db.store import clear_market_cache
+    clear_market_cache()
+    
+    # 旧数据库中文本形式的 token_id 按 BLOB 查询不到，打开时一次性迁移（函数内导入避免循环依赖）
+    from src.db.migrate_blob_ids import has_text_trade_ids, migrate_trade_ids
+    if has_text_trade_ids(conn):
+        count = migrate_trade_ids(conn)
+        print(f"Migrated {count} trades to BLOB token_id / order_hash")
+    
     return conn
 
 
@@ -146,10 +208,11 @@ def reset_db(db_path: str) -> sqlite3.Connection:
     Returns:
         数据库连接对象
     """
-    # 删除数据库文件
+    # 删除数据库文件（连同 WAL 模式下的 -wal / -shm 文件）
     db_file = Path(db_path)
-    if db_file.exists():
-        db_file.unlink()
+    for path in (db_file, Path(f"{db_path}-wal"), Path(f"{db_path}-shm")):
+        if path.exists():
+            path.unlink()
     
     # 重新初始化
     return init_db(db_path)
@@ -5,13 +5,299 @@
 """
 
 import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
 from datetime import datetime
-from typing import Dict, List, Optional, Any, Tuple
+from functools import lru_cache
+from itertools import chain, islice
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Any, Tuple, Union
+
+
+# SQL 语句统一定义为模块级常量：每次执行传入相同的文本，
+# 命中 sqlite3 连接的预编译语句缓存，省去重复的解析与查询规划
+_SQL_UPSERT_EVENT = """
+    INSERT INTO events (slug, title, description, start_date, end_date, enable_neg_risk, updated_at)
+    VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+    ON CONFLICT(slug) DO UPDATE SET
+        title = excluded.title,
+        description = excluded.description,
+        start_date = excluded.start_date,
+        end_date = excluded.end_date,
+        enable_neg_risk = excluded.enable_neg_risk,
+        updated_at = CURRENT_TIMESTAMP
+"""
+
+_SQL_UPSERT_EVENT_RETURNING = _SQL_UPSERT_EVENT + "    RETURNING id\n"
+
+_SQL_EVENT_ID_BY_SLUG = "SELECT id FROM events WHERE slug = ?"
+
+_SQL_UPSERT_MARKET = """
+    INSERT INTO markets (
+        event_id, slug, condition_id, question_id, oracle, 
+        collateral_token, yes_token_id, no_token_id, 
+        enable_neg_risk, status, title, description, updated_at
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+    ON CONFLICT(condition_id) DO UPDATE SET
+        event_id = excluded.event_id,
+        slug = excluded.slug,
+        question_id = excluded.question_id,
+        oracle = excluded.oracle,
+        collateral_token = excluded.collateral_token,
+        yes_token_id = excluded.yes_token_id,
+        no_token_id = excluded.no_token_id,
+        enable_neg_risk = excluded.enable_neg_risk,
+        status = excluded.status,
+        title = excluded.title,
+        description = excluded.description,
+        updated_at = CURRENT_TIMESTAMP
+"""
+
+_SQL_UPSERT_MARKET_RETURNING = _SQL_UPSERT_MARKET + "    RETURNING id\n"
+
+_SQL_MARKET_ID_BY_CONDITION_ID = "SELECT id FROM markets WHERE condition_id = ?"
+
+# upsert_markets_bulk 回查市场 ID 时每条 IN 查询的参数个数
+MARKET_ID_LOOKUP_BATCH = 500
+
+# SQLite 3.35 起支持 RETURNING，upsert 一条语句即可拿到 ID；旧版本回退到 upsert + SELECT
+_SUPPORTS_RETURNING = sqlite3.sqlite_version_info >= (3, 35, 0)
+
+_SQL_INSERT_TRADE_OR_IGNORE = """
+    INSERT OR IGNORE INTO trades (
+        market_id, tx_hash, log_index, block_number, timestamp,
+        exchange, order_hash, maker, taker, side, outcome,
+        price, size, token_id, maker_asset_id, taker_asset_id,
+        maker_amount, taker_amount, fee
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+
+class TradeRecord(NamedTuple):
+    """待写入 trades 表的交易记录（字段顺序与插入语句一致，批量插入时按属性直接取值）"""
+    market_id: int
+    tx_hash: str
+    log_index: int
+    block_number: int
+    timestamp: str
+    exchange: str
+    order_hash: str
+    maker: str
+    taker: str
+    side: str
+    outcome: str
+    price: str
+    size: str
+    token_id: str
+    maker_asset_id: str
+    taker_asset_id: str
+    maker_amount: str
+    taker_amount: str
+    fee: str
+    
+    @classmethod
+    def from_dict(cls, trade: Dict[str, Any]) -> "TradeRecord":
+        """由交易字典构造（缺失字段为 None）"""
+        return cls(*[trade.get(field) for field in cls._fields])
+
+
+# bulk_insert_trades 每批的行数：整批用一条多行 VALUES 语句插入，
+# 取 SQLite 默认变量上限 32766 能容纳的最大行数（19 列 → 1724 行）
+TRADE_BATCH_SIZE = 32766 // len(TradeRecord._fields)
+
+# 连接的变量上限只能容纳更少行时多行 VALUES 不再占优，回退到 executemany
+MULTI_VALUES_MIN_ROWS = 500
+
+# 无法查询变量上限时（Python < 3.11）按 SQLite 3.32 之前的默认值 999 处理
+_DEFAULT_VARIABLE_LIMIT = 999
+
+# iter_trades_for_* 每次从 SQLite 取回的行数
+TRADE_FETCH_SIZE = 1000
+
+_SQL_UPSERT_SYNC_STATE = """
+    INSERT INTO sync_state (key, last_block, updated_at)
+    VALUES (?, ?, CURRENT_TIMESTAMP)
+    ON CONFLICT(key) DO UPDATE SET
+        last_block = excluded.last_block,
+        updated_at = CURRENT_TIMESTAMP
+"""
+
+_SQL_GET_SYNC_STATE = "SELECT last_block FROM sync_state WHERE key = ?"
+
+# trades 表的二级索引（sql 为 NULL 的是唯一约束的自动索引，不在其中）
+_SQL_TRADE_INDEXES = """
+    SELECT sql, name FROM sqlite_master
+    WHERE type = 'index' AND tbl_name = 'trades' AND sql IS NOT NULL
+"""
+
+_SQL_ANY_TRADE = "SELECT 1 FROM trades LIMIT 1"
+
+_SQL_INSERT_BLOCK_TIMESTAMP = """
+    INSERT OR IGNORE INTO block_timestamps (block_number, timestamp) VALUES (?, ?)
+"""
+
+_SQL_BLOCK_TIMESTAMPS_IN_RANGE = """
+    SELECT block_number, timestamp FROM block_timestamps
+    WHERE block_number BETWEEN ? AND ?
+"""
+
+# 事件 / 市场查询的列顺序与下方 _EVENT_KEYS / _MARKET_KEYS 一致
+_SQL_EVENT_BY_SLUG = """
+    SELECT id, slug, title, description, start_date, end_date, 
+           enable_neg_risk, created_at, updated_at
+    FROM events WHERE slug = ?
+"""
+
+_SQL_MARKETS_SELECT = """
+    SELECT id AS market_id, event_id, slug, condition_id, question_id, oracle,
+           collateral_token, yes_token_id, no_token_id, enable_neg_risk,
+           status, title, description, created_at, updated_at
+    FROM markets
+"""
+
+# 结果行转字典时使用的键（与查询列顺序一致）
+_EVENT_KEYS = (
+    'id', 'slug', 'title', 'description', 'start_date', 'end_date',
+    'enable_neg_risk', 'created_at', 'updated_at'
+)
+
+_MARKET_KEYS = (
+    'market_id', 'event_id', 'slug', 'condition_id', 'question_id', 'oracle',
+    'collateral_token', 'yes_token_id', 'no_token_id', 'enable_neg_risk',
+    'status', 'title', 'description', 'created_at', 'updated_at'
+)
+
+_SQL_MARKET_BY_SLUG = _SQL_MARKETS_SELECT + "    WHERE slug = ?\n"
+
+_SQL_MARKET_BY_TOKEN_ID = _SQL_MARKETS_SELECT + "    WHERE yes_token_id = ? OR no_token_id = ?\n"
+
+_SQL_MARKETS_BY_EVENT_ID = _SQL_MARKETS_SELECT + """\
+    WHERE event_id = ?
+    ORDER BY created_at DESC
+"""
+
+# 交易查询结果的列名（与 _SQL_TRADES_SELECT 的列顺序一致）
+TRADE_COLUMNS = (
+    'trade_id', 'market_id', 'tx_hash', 'log_index', 'block_number', 'timestamp',
+    'exchange', 'order_hash', 'maker', 'taker', 'side', 'outcome',
+    'price', 'size', 'token_id', 'maker_asset_id', 'taker_asset_id',
+    'maker_amount', 'taker_amount', 'fee', 'created_at'
+)
+
+# BLOB 形式的 order_hash / token_id 在 SQL 中直接转为 0x 十六进制，结果行只含普通值
+_SQL_TRADES_SELECT = """
+    SELECT id, market_id, tx_hash, log_index, block_number, timestamp,
+           exchange,
+           CASE typeof(order_hash) WHEN 'blob' THEN '0x' || lower(hex(order_hash)) ELSE order_hash END,
+           maker, taker, side, outcome, price, size,
+           CASE typeof(token_id) WHEN 'blob' THEN '0x' || lower(hex(token_id)) ELSE token_id END,
+           maker_asset_id, taker_asset_id, maker_amount, taker_amount, fee, created_at
+    FROM trades
+"""
+
+
+# 交易分页查询：每种过滤列只有一条固定语句，始终命中预编译语句缓存。
+# 起始区块与 keyset 游标合并为 (block_number, log_index) 下界，结束区块未指定时取哨兵值；
+# 两个边界都落在复合索引上，不会因为区块过滤而丢失游标的索引定位。
+_TRADES_WHERE = """\
+    WHERE {key_column} = ? AND (block_number, log_index) > (?, ?) AND block_number <= ?
+    ORDER BY block_number ASC, log_index ASC
+    LIMIT ?
+"""
+
+_SQL_TRADES_BY_MARKET = _SQL_TRADES_SELECT + _TRADES_WHERE.format(key_column="market_id")
+
+_SQL_TRADES_BY_TOKEN = _SQL_TRADES_SELECT + _TRADES_WHERE.format(key_column="token_id")
+
+_TRADES_QUERIES = {"market_id": _SQL_TRADES_BY_MARKET, "token_id": _SQL_TRADES_BY_TOKEN}
+
+# 未指定边界时的哨兵值（log_index 从 0 开始，(-1, -1) 小于任何记录）
+_NO_LOWER_BOUND = (-1, -1)
+_MAX_BLOCK = (1 << 63) - 1
+
+
+def hex_id_to_blob(value: Any) -> Any:
+    """
+    将 bytes32 十六进制 ID（token_id、order_hash）编码为 32 字节 BLOB
+    
+    可带或不带 0x 前缀、大小写不敏感；非 bytes32 十六进制的值（空串、None 等）原样返回。
+    
+    Args:
+        value: 十六进制字符串
+        
+    Returns:
+        32 字节 bytes，或原值
+    """
+    if not isinstance(value, str):
+        return value
+    hex_part = value[2:] if value[:2] in ('0x', '0X') else value
+    if len(hex_part) != 64:
+        return value
+    try:
+        return bytes.fromhex(hex_part)
+    except ValueError:
+        return value
+
+
+@contextmanager
+def write_txn(conn: sqlite3.Connection) -> Iterator[sqlite3.Connection]:
+    """
+    显式写事务：BEGIN IMMEDIATE 开启，正常退出时 COMMIT，异常时 ROLLBACK
+    
+    连接已处于事务中时直接加入该事务，由最外层负责提交，因此可以嵌套使用。
+    
+    Args:
+        conn: 数据库连接（init_db 打开的连接为 isolation_level=None，不会隐式开启事务）
+    """
+    if conn.in_transaction:
+        yield conn
+        return
+    
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield conn
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+    if conn.in_transaction:
+        conn.execute("COMMIT")
+
+
+@contextmanager
+def deferred_trade_indexes(conn: sqlite3.Connection) -> Iterator[sqlite3.Connection]:
+    """
+    批量导入期间暂时删除 trades 表的二级索引，退出时（包括异常）按原 DDL 重建
+    
+    唯一约束 (tx_hash, log_index) 的自动索引不受影响，INSERT OR IGNORE 去重照常生效；
+    进程中途被杀时，下次 init_db 的 CREATE INDEX IF NOT EXISTS 会补回索引。
+    
+    Args:
+        conn: 数据库连接
+    """
+    with write_txn(conn):
+        indexes = conn.execute(_SQL_TRADE_INDEXES).fetchall()
+        for _, name in indexes:
+            conn.execute(f"DROP INDEX IF EXISTS {name}")
+    
+    try:
+        yield conn
+    finally:
+        with write_txn(conn):
+            for ddl, _ in indexes:
+                conn.execute(ddl)
+
+
+def has_trades(conn: sqlite3.Connection) -> bool:
+    """trades 表是否已有数据"""
+    return conn.execute(_SQL_ANY_TRADE).fetchone() is not None
 
 
 def upsert_event(conn: sqlite3.Connection, event: Dict[str, Any]) -> int:
     """
-    插入或更新事件信息
+    插入或更新事件信息（不提交事务，由调用方负责，如 `with write_txn(conn):`）
     
     Args:
         conn: 数据库连接
@@ -22,67 +308,30 @@ def upsert_event(conn: sqlite3.Connection, event: Dict[str, Any]) -> int:
     """
     cursor = conn.cursor()
     
-    cursor.execute("""
-        INSERT INTO events (slug, title, description, start_date, end_date, enable_neg_risk, updated_at)
-        VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-        ON CONFLICT(slug) DO UPDATE SET
-            title = excluded.title,
-            description = excluded.description,
-            start_date = excluded.start_date,
-            end_date = excluded.end_date,
-            enable_neg_risk = excluded.enable_neg_risk,
-            updated_at = CURRENT_TIMESTAMP
-    """, (
+    params = (
         event.get('slug'),
         event.get('title'),
         event.get('description'),
         event.get('start_date'),
         event.get('end_date'),
         event.get('enable_neg_risk', False)
-    ))
+    )
     
-    # 获取插入或更新的事件 ID
-    cursor.execute("SELECT id FROM events WHERE slug = ?", (event.get('slug'),))
-    result = cursor.fetchone()
-    conn.commit()
+    if _SUPPORTS_RETURNING:
+        result = cursor.execute(_SQL_UPSERT_EVENT_RETURNING, params).fetchone()
+    else:
+        cursor.execute(_SQL_UPSERT_EVENT, params)
+        
+        # 获取插入或更新的事件 ID
+        cursor.execute(_SQL_EVENT_ID_BY_SLUG, (event.get('slug'),))
+        result = cursor.fetchone()
     
     return result[0] if result else None
 
 
-def upsert_market(conn: sqlite3.Connection, market: Dict[str, Any]) -> int:
-    """
-    插入或更新市场信息
-    
-    Args:
-        conn: 数据库连接
-        market: 市场信息字典
-        
-    Returns:
-        市场 ID
-    """
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        INSERT INTO markets (
-            event_id, slug, condition_id, question_id, oracle, 
-            collateral_token, yes_token_id, no_token_id, 
-            enable_neg_risk, status, title, description, updated_at
-        )
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
-        ON CONFLICT(condition_id) DO UPDATE SET
-            event_id = excluded.event_id,
-            slug = excluded.slug,
-            question_id = excluded.question_id,
-            oracle = excluded.oracle,
-            collateral_token = excluded.collateral_token,
-            yes_token_id = excluded.yes_token_id,
-            no_token_id = excluded.no_token_id,
-            enable_neg_risk = excluded.enable_neg_risk,
-            status = excluded.status,
-            title = excluded.title,
-            description = excluded.description,
-            updated_at = CURRENT_TIMESTAMP
-    """, (
+def _market_upsert_row(market: Dict[str, Any]) -> Tuple[Any, ...]:
+    """按 upsert 语句的列顺序生成一行参数"""
+    return (
         market.get('event_id'),
         market.get('slug'),
         market.get('condition_id'),
@@ -95,23 +344,78 @@ def upsert_market(conn: sqlite3.Connection, market: Dict[str, Any]) -> int:
         market.get('status', 'active'),
         market.get('title'),
         market.get('description')
-    ))
+    )
+
+
+def upsert_market(conn: sqlite3.Connection, market: Dict[str, Any]) -> int:
+    """
+    插入或更新市场信息（不提交事务，由调用方负责，如 `with write_txn(conn):`）
     
-    # 获取插入或更新的市场 ID
-    cursor.execute("SELECT id FROM markets WHERE condition_id = ?", (market.get('condition_id'),))
-    result = cursor.fetchone()
-    conn.commit()
+    Args:
+        conn: 数据库连接
+        market: 市场信息字典
+        
+    Returns:
+        市场 ID
+    """
+    _invalidate_market_cache((market,))
+    cursor = conn.cursor()
+    params = _market_upsert_row(market)
+    
+    if _SUPPORTS_RETURNING:
+        result = cursor.execute(_SQL_UPSERT_MARKET_RETURNING, params).fetchone()
+    else:
+        cursor.execute(_SQL_UPSERT_MARKET, params)
+        
+        # 获取插入或更新的市场 ID
+        cursor.execute(_SQL_MARKET_ID_BY_CONDITION_ID, (market.get('condition_id'),))
+        result = cursor.fetchone()
     
     return result[0] if result else None
 
 
-def insert_trades(conn: sqlite3.Connection, trades: List[Dict[str, Any]]) -> int:
+def upsert_markets_bulk(conn: sqlite3.Connection, markets: List[Dict[str, Any]]) -> List[int]:
+    """
+    批量插入或更新市场信息（不提交事务，由调用方负责，如 `with write_txn(conn):`）
+    
+    一次 executemany 完成 upsert，再用一条 IN 查询取回全部市场 ID。
+    
+    Args:
+        conn: 数据库连接
+        markets: 市场信息字典列表
+        
+    Returns:
+        与输入顺序一致的市场 ID 列表
+    """
+    if not markets:
+        return []
+    
+    _invalidate_market_cache(markets)
+    cursor = conn.cursor()
+    cursor.executemany(_SQL_UPSERT_MARKET, [_market_upsert_row(market) for market in markets])
+    
+    # 按 condition_id 回查 ID（分批，避免超出 SQLite 绑定参数上限）
+    condition_ids = [market.get('condition_id') for market in markets]
+    id_by_condition: Dict[str, int] = {}
+    for start in range(0, len(condition_ids), MARKET_ID_LOOKUP_BATCH):
+        batch = condition_ids[start:start + MARKET_ID_LOOKUP_BATCH]
+        placeholders = ", ".join("?" * len(batch))
+        cursor.execute(
+            f"SELECT condition_id, id FROM markets WHERE condition_id IN ({placeholders})",
+            batch
+        )
+        id_by_condition.update(cursor.fetchall())
+    
+    return [id_by_condition.get(condition_id) for condition_id in condition_ids]
+
+
+def insert_trades(conn: sqlite3.Connection, trades: List[Union[TradeRecord, Dict[str, Any]]]) -> int:
     """
     批量插入交易记录（忽略重复）
     
     Args:
         conn: 数据库连接
-        trades: 交易记录列表
+        trades: 交易记录列表（TradeRecord 或字典）
         
     Returns:
         成功插入的记录数
@@ -119,52 +423,101 @@ def insert_trades(conn: sqlite3.Connection, trades: List[Dict[str, Any]]) -> int
     if not trades:
         return 0
     
+    # 单事务 + executemany + INSERT OR IGNORE，重复记录由 SQLite 在 C 层跳过
+    return bulk_insert_trades(conn, trades)
+
+
+def _trade_insert_row(trade: Union[TradeRecord, Dict[str, Any]]) -> Tuple[Any, ...]:
+    """按插入语句的列顺序生成一行参数（order_hash / token_id 编码为 BLOB）"""
+    if not isinstance(trade, TradeRecord):
+        trade = TradeRecord.from_dict(trade)
+    
+    return (
+        trade.market_id,
+        trade.tx_hash,
+        trade.log_index,
+        trade.block_number,
+        trade.timestamp,
+        trade.exchange,
+        hex_id_to_blob(trade.order_hash),
+        trade.maker,
+        trade.taker,
+        trade.side,
+        trade.outcome,
+        trade.price,
+        trade.size,
+        hex_id_to_blob(trade.token_id),
+        trade.maker_asset_id,
+        trade.taker_asset_id,
+        trade.maker_amount,
+        trade.taker_amount,
+        trade.fee
+    )
+
+
+@lru_cache(maxsize=8)
+def _multi_values_insert_sql(row_count: int) -> str:
+    """生成一次插入 row_count 行的 INSERT OR IGNORE 语句（按行数缓存，实际只会用到一两种）"""
+    placeholders = "(" + ", ".join("?" * len(TradeRecord._fields)) + ")"
+    head = _SQL_INSERT_TRADE_OR_IGNORE.rsplit("VALUES", 1)[0]
+    return f"{head}VALUES {', '.join([placeholders] * row_count)}"
+
+
+def _rows_per_statement(conn: sqlite3.Connection, batch_size: int) -> int:
+    """连接的变量上限（SQLITE_LIMIT_VARIABLE_NUMBER）允许的每条语句最大行数，不超过 batch_size"""
+    if hasattr(conn, "getlimit"):
+        variable_limit = conn.getlimit(sqlite3.SQLITE_LIMIT_VARIABLE_NUMBER)
+    else:
+        variable_limit = _DEFAULT_VARIABLE_LIMIT
+    return min(batch_size, variable_limit // len(TradeRecord._fields))
+
+
+def bulk_insert_trades(
+    conn: sqlite3.Connection,
+    trades: Iterable[Union[TradeRecord, Dict[str, Any]]],
+    batch_size: int = TRADE_BATCH_SIZE
+) -> int:
+    """
+    批量插入交易记录（INSERT OR IGNORE 忽略重复）
+    
+    在 write_txn 中执行：调用方已开启事务时加入该事务、不提交；否则自行开启并提交。
+    满批的行用一条多行 VALUES 语句插入（比 executemany 逐行执行少一次 VDBE 往返），
+    末尾不足一批的行及变量上限过低的连接使用 executemany。
+    
+    Args:
+        conn: 数据库连接
+        trades: 交易记录（TradeRecord 或字典的列表 / 可迭代对象）
+        batch_size: 每批的行数
+        
+    Returns:
+        成功插入的记录数
+    """
+    rows = (_trade_insert_row(trade) for trade in trades)
+    
+    batch_size = _rows_per_statement(conn, batch_size) or 1
+    multi_values_sql = None
+    if batch_size >= MULTI_VALUES_MIN_ROWS:
+        multi_values_sql = _multi_values_insert_sql(batch_size)
+    
     cursor = conn.cursor()
-    inserted_count = 0
-    
-    for trade in trades:
-        try:
-            cursor.execute("""
-                INSERT INTO trades (
-                    market_id, tx_hash, log_index, block_number, timestamp,
-                    exchange, order_hash, maker, taker, side, outcome,
-                    price, size, token_id, maker_asset_id, taker_asset_id,
-                    maker_amount, taker_amount, fee
-                )
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, (
-                trade.get('market_id'),
-                trade.get('tx_hash'),
-                trade.get('log_index'),
-                trade.get('block_number'),
-                trade.get('timestamp'),
-                trade.get('exchange'),
-                trade.get('order_hash'),
-                trade.get('maker'),
-                trade.get('taker'),
-                trade.get('side'),
-                trade.get('outcome'),
-                trade.get('price'),
-                trade.get('size'),
-                trade.get('token_id'),
-                trade.get('maker_asset_id'),
-                trade.get('taker_asset_id'),
-                trade.get('maker_amount'),
-                trade.get('taker_amount'),
-                trade.get('fee')
-            ))
-            inserted_count += 1
-        except sqlite3.IntegrityError:
-            # 忽略重复记录
-            pass
-    
-    conn.commit()
-    return inserted_count
+    changes_before = conn.total_changes
+    
+    with write_txn(conn):
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            if multi_values_sql is not None and len(batch) == batch_size:
+                cursor.execute(multi_values_sql, list(chain.from_iterable(batch)))
+            else:
+                cursor.executemany(_SQL_INSERT_TRADE_OR_IGNORE, batch)
+    
+    return conn.total_changes - changes_before
 
 
 def update_sync_state(conn: sqlite3.Connection, key: str, last_block: int) -> None:
     """
-    更新同步状态
+    更新同步状态（不提交事务，由调用方负责，如 `with write_txn(conn):`）
     
     Args:
         conn: 数据库连接
@@ -172,14 +525,7 @@ def update_sync_state(conn: sqlite3.Connection, key: str, last_block: int) -> No
         last_block: 最后处理的区块高度
     """
     cursor = conn.cursor()
-    cursor.execute("""
-        INSERT INTO sync_state (key, last_block, updated_at)
-        VALUES (?, ?, CURRENT_TIMESTAMP)
-        ON CONFLICT(key) DO UPDATE SET
-            last_block = excluded.last_block,
-            updated_at = CURRENT_TIMESTAMP
-    """, (key, last_block))
-    conn.commit()
+    cursor.execute(_SQL_UPSERT_SYNC_STATE, (key, last_block))
 
 
 def get_sync_state(conn: sqlite3.Connection, key: str) -> Optional[int]:
@@ -194,11 +540,136 @@ def get_sync_state(conn: sqlite3.Connection, key: str) -> Optional[int]:
         最后处理的区块高度，如果不存在则返回 None
     """
     cursor = conn.cursor()
-    cursor.execute("SELECT last_block FROM sync_state WHERE key = ?", (key,))
+    cursor.execute(_SQL_GET_SYNC_STATE, (key,))
     result = cursor.fetchone()
     return result[0] if result else None
 
 
+def save_block_timestamps(conn: sqlite3.Connection, timestamps: Dict[int, int]) -> None:
+    """
+    持久化区块时间戳（已存在的区块忽略；不提交事务，由调用方负责，如 `with write_txn(conn):`）
+    
+    Args:
+        conn: 数据库连接
+        timestamps: {区块号: Unix 时间戳}
+    """
+    conn.executemany(_SQL_INSERT_BLOCK_TIMESTAMP, timestamps.items())
+
+
+def fetch_block_timestamps(conn: sqlite3.Connection, from_block: int, to_block: int) -> Dict[int, int]:
+    """
+    读取区块范围内已持久化的区块时间戳
+    
+    Args:
+        conn: 数据库连接
+        from_block: 起始区块
+        to_block: 结束区块
+        
+    Returns:
+        {区块号: Unix 时间戳}
+    """
+    return dict(conn.execute(_SQL_BLOCK_TIMESTAMPS_IN_RANGE, (from_block, to_block)))
+
+
+def _row_to_dict(keys: Tuple[str, ...], row: Optional[Tuple[Any, ...]]) -> Optional[Dict[str, Any]]:
+    """按键元组将结果行转为字典（enable_neg_risk 转为 bool）"""
+    if row is None:
+        return None
+    
+    record = dict(zip(keys, row))
+    record['enable_neg_risk'] = bool(record['enable_neg_risk'])
+    return record
+
+
+# 市场查询缓存：模块级，(查询类型, 键) -> 市场字典或 None（未找到同样缓存）
+# 超出 MARKET_CACHE_SIZE 时淘汰最久未使用的条目；init_db 打开数据库时清空
+MARKET_CACHE_SIZE = 4096
+
+_market_cache: "OrderedDict[Tuple[str, str], Optional[Dict[str, Any]]]" = OrderedDict()
+_market_cache_lock = threading.Lock()
+# 每次失效递增；查询期间发生失效则不回填，避免把失效前读到的旧行写回缓存
+_market_cache_generation = 0
+# 最近一次 sync_market_cache 看到的数据库版本
+_market_cache_version: Any = None
+
+
+def _invalidate_market_cache(markets: Iterable[Dict[str, Any]]) -> None:
+    """弹出与给定市场相关的缓存条目（slug、两个 token_id 以及同一 condition_id 的已缓存条目）"""
+    global _market_cache_generation
+    
+    keys = set()
+    condition_ids = set()
+    for market in markets:
+        keys.add(('slug', market.get('slug')))
+        keys.add(('token_id', market.get('yes_token_id')))
+        keys.add(('token_id', market.get('no_token_id')))
+        condition_ids.add(market.get('condition_id'))
+    
+    with _market_cache_lock:
+        _market_cache_generation += 1
+        for cache_key, cached in _market_cache.items():
+            if cached is not None and cached['condition_id'] in condition_ids:
+                keys.add(cache_key)
+        for cache_key in keys:
+            _market_cache.pop(cache_key, None)
+
+
+def clear_market_cache() -> None:
+    """清空市场查询缓存"""
+    global _market_cache_generation, _market_cache_version
+    
+    with _market_cache_lock:
+        _market_cache_generation += 1
+        _market_cache.clear()
+    _market_cache_version = None
+
+
+def sync_market_cache(version: Any) -> None:
+    """
+    按数据库版本同步市场查询缓存
+    
+    本进程内的 upsert 会直接弹出相关条目；其它进程的写入只能靠版本号发现。
+    调用方应每个请求 / 批次调用一次（如传入 SQLitePool.data_version()），而不是每次查询都检查。
+    
+    Args:
+        version: 数据库版本，与上次不同时清空缓存
+    """
+    global _market_cache_version
+    
+    if version != _market_cache_version:
+        clear_market_cache()
+        _market_cache_version = version
+
+
+def _cached_market(
+    conn: sqlite3.Connection,
+    kind: str,
+    key: str,
+    sql: str,
+    params: Tuple[Any, ...]
+) -> Optional[Dict[str, Any]]:
+    """带缓存地查询单个市场（未找到的结果同样缓存），返回副本以免调用方修改缓存"""
+    cache_key = (kind, key)
+    
+    with _market_cache_lock:
+        hit = cache_key in _market_cache
+        if hit:
+            market = _market_cache[cache_key]
+            _market_cache.move_to_end(cache_key)
+        generation = _market_cache_generation
+    
+    if not hit:
+        market = _row_to_dict(_MARKET_KEYS, conn.execute(sql, params).fetchone())
+        with _market_cache_lock:
+            if generation == _market_cache_generation:
+                _market_cache[cache_key] = market
+                _market_cache.move_to_end(cache_key)
+                if len(_market_cache) > MARKET_CACHE_SIZE:
+                    _market_cache.popitem(last=False)
+    
+    return dict(market) if market is not None else None
+
+
 def fetch_event_by_slug(conn: sqlite3.Connection, slug: str) -> Optional[Dict[str, Any]]:
     """
     根据 slug 查询事件
@@ -211,32 +682,14 @@ def fetch_event_by_slug(conn: sqlite3.Connection, slug: str) -> Optional[Dict[st
         事件信息字典，如果不存在则返回 None
     """
     cursor = conn.cursor()
-    cursor.execute("""
-        SELECT id, slug, title, description, start_date, end_date, 
-               enable_neg_risk, created_at, updated_at
-        FROM events WHERE slug = ?
-    """, (slug,))
+    cursor.execute(_SQL_EVENT_BY_SLUG, (slug,))
     
-    result = cursor.fetchone()
-    if not result:
-        return None
-    
-    return {
-        'id': result[0],
-        'slug': result[1],
-        'title': result[2],
-        'description': result[3],
-        'start_date': result[4],
-        'end_date': result[5],
-        'enable_neg_risk': bool(result[6]),
-        'created_at': result[7],
-        'updated_at': result[8]
-    }
+    return _row_to_dict(_EVENT_KEYS, cursor.fetchone())
 
 
 def fetch_market_by_slug(conn: sqlite3.Connection, slug: str) -> Optional[Dict[str, Any]]:
     """
-    根据 slug 查询市场
+    根据 slug 查询市场（模块级缓存，upsert_market 时失效）
     
     Args:
         conn: 数据库连接
@@ -245,40 +698,12 @@ def fetch_market_by_slug(conn: sqlite3.Connection, slug: str) -> Optional[Dict[s
     Returns:
         市场信息字典，如果不存在则返回 None
     """
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT id, event_id, slug, condition_id, question_id, oracle,
-               collateral_token, yes_token_id, no_token_id, enable_neg_risk,
-               status, title, description, created_at, updated_at
-        FROM markets WHERE slug = ?
-    """, (slug,))
-    
-    result = cursor.fetchone()
-    if not result:
-        return None
-    
-    return {
-        'market_id': result[0],
-        'event_id': result[1],
-        'slug': result[2],
-        'condition_id': result[3],
-        'question_id': result[4],
-        'oracle': result[5],
-        'collateral_token': result[6],
-        'yes_token_id': result[7],
-        'no_token_id': result[8],
-        'enable_neg_risk': bool(result[9]),
-        'status': result[10],
-        'title': result[11],
-        'description': result[12],
-        'created_at': result[13],
-        'updated_at': result[14]
-    }
+    return _cached_market(conn, 'slug', slug, _SQL_MARKET_BY_SLUG, (slug,))
 
 
 def fetch_market_by_token_id(conn: sqlite3.Connection, token_id: str) -> Optional[Dict[str, Any]]:
     """
-    根据 token_id 查询市场
+    根据 token_id 查询市场（模块级缓存，upsert_market 时失效）
     
     Args:
         conn: 数据库连接
@@ -287,35 +712,7 @@ def fetch_market_by_token_id(conn: sqlite3.Connection, token_id: str) -> Optiona
     Returns:
         市场信息字典，如果不存在则返回 None
     """
-    cursor = conn.cursor()
-    cursor.execute("""
-        SELECT id, event_id, slug, condition_id, question_id, oracle,
-               collateral_token, yes_token_id, no_token_id, enable_neg_risk,
-               status, title, description, created_at, updated_at
-        FROM markets WHERE yes_token_id = ? OR no_token_id = ?
-    """, (token_id, token_id))
-    
-    result = cursor.fetchone()
-    if not result:
-        return None
-    
-    return {
-        'market_id': result[0],
-        'event_id': result[1],
-        'slug': result[2],
-        'condition_id': result[3],
-        'question_id': result[4],
-        'oracle': result[5],
-        'collateral_token': result[6],
-        'yes_token_id': result[7],
-        'no_token_id': result[8],
-        'enable_neg_risk': bool(result[9]),
-        'status': result[10],
-        'title': result[11],
-        'description': result[12],
-        'created_at': result[13],
-        'updated_at': result[14]
-    }
+    return _cached_market(conn, 'token_id', token_id, _SQL_MARKET_BY_TOKEN_ID, (token_id, token_id))
 
 
 def fetch_markets_by_event_id(conn: sqlite3.Connection, event_id: int) -> List[Dict[str, Any]]:
@@ -330,43 +727,138 @@ def fetch_markets_by_event_id(conn: sqlite3.Connection, event_id: int) -> List[D
         市场信息列表
     """
     cursor = conn.cursor()
-    cursor.execute("""
-        SELECT id, event_id, slug, condition_id, question_id, oracle,
-               collateral_token, yes_token_id, no_token_id, enable_neg_risk,
-               status, title, description, created_at, updated_at
-        FROM markets WHERE event_id = ?
-        ORDER BY created_at DESC
-    """, (event_id,))
-    
-    results = cursor.fetchall()
-    markets = []
-    for result in results:
-        markets.append({
-            'market_id': result[0],
-            'event_id': result[1],
-            'slug': result[2],
-            'condition_id': result[3],
-            'question_id': result[4],
-            'oracle': result[5],
-            'collateral_token': result[6],
-            'yes_token_id': result[7],
-            'no_token_id': result[8],
-            'enable_neg_risk': bool(result[9]),
-            'status': result[10],
-            'title': result[11],
-            'description': result[12],
-            'created_at': result[13],
-            'updated_at': result[14]
-        })
-    
-    return markets
+    cursor.execute(_SQL_MARKETS_BY_EVENT_ID, (event_id,))
+    
+    return [_row_to_dict(_MARKET_KEYS, row) for row in cursor.fetchall()]
+
+
+def fetch_markets_by_token(conn: sqlite3.Connection) -> Dict[str, Tuple[Dict[str, Any], str]]:
+    """
+    一次性加载全部市场，按 token_id（小写）建立索引，供索引器逐条日志 O(1) 匹配市场
+    
+    Args:
+        conn: 数据库连接
+        
+    Returns:
+        {token_id 小写: (市场信息字典, "YES" 或 "NO")}，YES / NO 两个 token 指向同一个市场字典；
+        键与 trade_decoder 输出的 token_id 格式一致（0x + 64 位小写十六进制）
+    """
+    markets_by_token = {}
+    for row in conn.execute(_SQL_MARKETS_SELECT):
+        market = _row_to_dict(_MARKET_KEYS, row)
+        markets_by_token[market['yes_token_id'].lower()] = (market, "YES")
+        markets_by_token[market['no_token_id'].lower()] = (market, "NO")
+    
+    return markets_by_token
+
+
+def _execute_trades_query(
+    conn: sqlite3.Connection,
+    key_column: str,
+    key: Any,
+    limit: Optional[int],
+    after: Optional[Tuple[int, int]],
+    from_block: Optional[int],
+    to_block: Optional[int]
+) -> sqlite3.Cursor:
+    """按 market_id / token_id 执行交易查询，结果行按 TRADE_COLUMNS 排列；limit 为 None 时不限条数"""
+    # 下界：起始区块的第一条记录之前，与分页游标取较大者
+    lower = after if after is not None else _NO_LOWER_BOUND
+    if from_block is not None:
+        lower = max(lower, (from_block, -1))
+    
+    params = (
+        key,
+        lower[0],
+        lower[1],
+        _MAX_BLOCK if to_block is None else to_block,
+        # SQLite 中 LIMIT -1 表示不限制
+        -1 if limit is None else limit
+    )
+    
+    query = _TRADES_QUERIES[key_column]
+    return conn.execute(query, params)
+
+
+def _fetch_trade_rows(
+    conn: sqlite3.Connection,
+    key_column: str,
+    key: Any,
+    limit: int,
+    after: Optional[Tuple[int, int]],
+    from_block: Optional[int],
+    to_block: Optional[int]
+) -> List[Tuple[Any, ...]]:
+    """按 market_id / token_id 分页查询交易，返回按 TRADE_COLUMNS 排列的元组"""
+    return _execute_trades_query(conn, key_column, key, limit, after, from_block, to_block).fetchall()
+
+
+def _iter_trades(cursor: sqlite3.Cursor) -> Iterator[Dict[str, Any]]:
+    """按 TRADE_FETCH_SIZE 分批取回结果行并逐条生成交易字典"""
+    cursor.arraysize = TRADE_FETCH_SIZE
+    while True:
+        rows = cursor.fetchmany()
+        if not rows:
+            break
+        for row in rows:
+            yield dict(zip(TRADE_COLUMNS, row))
+
+
+def fetch_trade_rows_for_market(
+    conn: sqlite3.Connection,
+    market_id: int,
+    limit: int = 100,
+    after: Optional[Tuple[int, int]] = None,
+    from_block: Optional[int] = None,
+    to_block: Optional[int] = None
+) -> List[Tuple[Any, ...]]:
+    """
+    查询市场的交易记录（元组形式，列顺序见 TRADE_COLUMNS）
+    
+    Args:
+        conn: 数据库连接
+        market_id: 市场 ID
+        limit: 返回条数限制
+        after: 分页游标，上一页最后一条记录的 (block_number, log_index)
+        from_block: 起始区块
+        to_block: 结束区块
+        
+    Returns:
+        交易记录元组列表
+    """
+    return _fetch_trade_rows(conn, "market_id", market_id, limit, after, from_block, to_block)
+
+
+def fetch_trade_rows_for_token(
+    conn: sqlite3.Connection,
+    token_id: str,
+    limit: int = 100,
+    after: Optional[Tuple[int, int]] = None,
+    from_block: Optional[int] = None,
+    to_block: Optional[int] = None
+) -> List[Tuple[Any, ...]]:
+    """
+    查询指定 token_id 的交易记录（元组形式，列顺序见 TRADE_COLUMNS）
+    
+    Args:
+        conn: 数据库连接
+        token_id: Token ID
+        limit: 返回条数限制
+        after: 分页游标，上一页最后一条记录的 (block_number, log_index)
+        from_block: 起始区块
+        to_block: 结束区块
+        
+    Returns:
+        交易记录元组列表
+    """
+    return _fetch_trade_rows(conn, "token_id", hex_id_to_blob(token_id), limit, after, from_block, to_block)
 
 
 def fetch_trades_for_market(
     conn: sqlite3.Connection,
     market_id: int,
     limit: int = 100,
-    cursor: int = 0,
+    after: Optional[Tuple[int, int]] = None,
     from_block: Optional[int] = None,
     to_block: Optional[int] = None
 ) -> List[Dict[str, Any]]:
@@ -377,78 +869,22 @@ def fetch_trades_for_market(
         conn: 数据库连接
         market_id: 市场 ID
         limit: 返回条数限制
-        cursor: 分页偏移量
+        after: 分页游标，上一页最后一条记录的 (block_number, log_index)
         from_block: 起始区块
         to_block: 结束区块
         
     Returns:
         交易记录列表
     """
-    db_cursor = conn.cursor()
-    
-    # 构建查询条件
-    where_clauses = ["market_id = ?"]
-    params = [market_id]
-    
-    if from_block is not None:
-        where_clauses.append("block_number >= ?")
-        params.append(from_block)
-    
-    if to_block is not None:
-        where_clauses.append("block_number <= ?")
-        params.append(to_block)
-    
-    where_clause = " AND ".join(where_clauses)
-    
-    # 添加分页参数
-    params.extend([limit, cursor])
-    
-    db_cursor.execute(f"""
-        SELECT id, market_id, tx_hash, log_index, block_number, timestamp,
-               exchange, order_hash, maker, taker, side, outcome,
-               price, size, token_id, maker_asset_id, taker_asset_id,
-               maker_amount, taker_amount, fee, created_at
-        FROM trades
-        WHERE {where_clause}
-        ORDER BY block_number ASC, log_index ASC
-        LIMIT ? OFFSET ?
-    """, params)
-    
-    results = db_cursor.fetchall()
-    trades = []
-    for result in results:
-        trades.append({
-            'trade_id': result[0],
-            'market_id': result[1],
-            'tx_hash': result[2],
-            'log_index': result[3],
-            'block_number': result[4],
-            'timestamp': result[5],
-            'exchange': result[6],
-            'order_hash': result[7],
-            'maker': result[8],
-            'taker': result[9],
-            'side': result[10],
-            'outcome': result[11],
-            'price': result[12],
-            'size': result[13],
-            'token_id': result[14],
-            'maker_asset_id': result[15],
-            'taker_asset_id': result[16],
-            'maker_amount': result[17],
-            'taker_amount': result[18],
-            'fee': result[19],
-            'created_at': result[20]
-        })
-    
-    return trades
+    rows = fetch_trade_rows_for_market(conn, market_id, limit, after, from_block, to_block)
+    return [dict(zip(TRADE_COLUMNS, row)) for row in rows]
 
 
 def fetch_trades_for_token(
     conn: sqlite3.Connection,
     token_id: str,
     limit: int = 100,
-    cursor: int = 0,
+    after: Optional[Tuple[int, int]] = None,
     from_block: Optional[int] = None,
     to_block: Optional[int] = None
 ) -> List[Dict[str, Any]]:
@@ -459,68 +895,68 @@ def fetch_trades_for_token(
         conn: 数据库连接
         token_id: Token ID
         limit: 返回条数限制
-        cursor: 分页偏移量
+        after: 分页游标，上一页最后一条记录的 (block_number, log_index)
         from_block: 起始区块
         to_block: 结束区块
         
     Returns:
         交易记录列表
     """
-    db_cursor = conn.cursor()
+    rows = fetch_trade_rows_for_token(conn, token_id, limit, after, from_block, to_block)
+    return [dict(zip(TRADE_COLUMNS, row)) for row in rows]
+
+
+def iter_trades_for_market(
+    conn: sqlite3.Connection,
+    market_id: int,
+    limit: Optional[int] = None,
+    after: Optional[Tuple[int, int]] = None,
+    from_block: Optional[int] = None,
+    to_block: Optional[int] = None
+) -> Iterator[Dict[str, Any]]:
+    """
+    流式查询市场的交易记录（用于导出等大批量读取，不一次性载入全部结果）
     
-    # 构建查询条件
-    where_clauses = ["token_id = ?"]
-    params = [token_id]
+    生成器耗尽之前不要在同一连接上并发执行其它查询。
     
-    if from_block is not None:
-        where_clauses.append("block_number >= ?")
-        params.append(from_block)
-    
-    if to_block is not None:
-        where_clauses.append("block_number <= ?")
-        params.append(to_block)
-    
-    where_clause = " AND ".join(where_clauses)
-    
-    # 添加分页参数
-    params.extend([limit, cursor])
-    
-    db_cursor.execute(f"""
-        SELECT id, market_id, tx_hash, log_index, block_number, timestamp,
-               exchange, order_hash, maker, taker, side, outcome,
-               price, size, token_id, maker_asset_id, taker_asset_id,
-               maker_amount, taker_amount, fee, created_at
-        FROM trades
-        WHERE {where_clause}
-        ORDER BY block_number ASC, log_index ASC
-        LIMIT ? OFFSET ?
-    """, params)
-    
-    results = db_cursor.fetchall()
-    trades = []
-    for result in results:
-        trades.append({
-            'trade_id': result[0],
-            'market_id': result[1],
-            'tx_hash': result[2],
-            'log_index': result[3],
-            'block_number': result[4],
-            'timestamp': result[5],
-            'exchange': result[6],
-            'order_hash': result[7],
-            'maker': result[8],
-            'taker': result[9],
-            'side': result[10],
-            'outcome': result[11],
-            'price': result[12],
-            'size': result[13],
-            'token_id': result[14],
-            'maker_asset_id': result[15],
-            'taker_asset_id': result[16],
-            'maker_amount': result[17],
-            'taker_amount': result[18],
-            'fee': result[19],
-            'created_at': result[20]
-        })
-    
-    return trades
+    Args:
+        conn: 数据库连接
+        market_id: 市场 ID
+        limit: 返回条数限制（默认不限制）
+        after: 起始游标 (block_number, log_index)
+        from_block: 起始区块
+        to_block: 结束区块
+        
+    Returns:
+        交易记录迭代器
+    """
+    cursor = _execute_trades_query(conn, "market_id", market_id, limit, after, from_block, to_block)
+    return _iter_trades(cursor)
+
+
+def iter_trades_for_token(
+    conn: sqlite3.Connection,
+    token_id: str,
+    limit: Optional[int] = None,
+    after: Optional[Tuple[int, int]] = None,
+    from_block: Optional[int] = None,
+    to_block: Optional[int] = None
+) -> Iterator[Dict[str, Any]]:
+    """
+    流式查询指定 token_id 的交易记录（用于导出等大批量读取，不一次性载入全部结果）
+    
+    生成器耗尽之前不要在同一连接上并发执行其它查询。
+    
+    Args:
+        conn: 数据库连接
+        token_id: Token ID
+        limit: 返回条数限制（默认不限制）
+        after: 起始游标 (block_number, log_index)
+        from_block: 起始区块
+        to_block: 结束区块
+        
+    Returns:
+        交易记录迭代器
+    """
+    cursor = _execute_trades_query(conn, "token_id", hex_id_to_blob(token_id), limit, after, from_block, to_block)
+    return _iter_trades(cursor)
@@ -11,7 +11,10 @@ import sys
 from pathlib import Path
 from typing import Optional
 
+import requests
 from dotenv import load_dotenv
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from web3 import Web3
 
 from src.db.schema import init_db, reset_db
@@ -19,6 +22,33 @@ from src.indexer.discovery import discover_markets
 from src.indexer.run import run_indexer, index_single_transaction
 
 
+# RPC 请求超时（秒）与连接池大小
+RPC_TIMEOUT = 30
+RPC_POOL_SIZE = 32
+
+
+def make_rpc_session() -> requests.Session:
+    """
+    创建 RPC 用的 HTTP 会话：keep-alive 连接池复用 TLS 连接，连接错误与限流/网关错误自动重试
+    
+    Returns:
+        requests 会话
+    """
+    # JSON-RPC 的查询请求都是 POST 且幂等，允许对 POST 重试
+    retry = Retry(
+        total=5,
+        backoff_factor=0.2,
+        status_forcelist=(429, 502, 503, 504),
+        allowed_methods=frozenset({"POST"})
+    )
+    adapter = HTTPAdapter(pool_maxsize=RPC_POOL_SIZE, max_retries=retry)
+    
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
 def main():
     parser = argparse.ArgumentParser(description="Stage 2 Indexer Demo")
     
@@ -49,7 +79,11 @@ def main():
         sys.exit(1)
     
     # 初始化 Web3
-    w3 = Web3(Web3.HTTPProvider(rpc_url))
+    w3 = Web3(Web3.HTTPProvider(
+        rpc_url,
+        session=make_rpc_session(),
+        request_kwargs={'timeout': RPC_TIMEOUT}
+    ))
     
     # 添加 POA 中间件（Polygon 需要）
     from web3.middleware import ExtraDataToPOAMiddleware
@@ -4,9 +4,12 @@ Market Discovery Service - 任务 A
 从 Gamma API 获取市场信息并存储到数据库。
 """
 
+import json
 import sqlite3
+from collections import OrderedDict
 import requests
-from typing import Dict, List, Any, Optional
+from requests.adapters import HTTPAdapter
+from typing import Dict, List, Any, Optional, Tuple
 from web3 import Web3
 
 from src.ctf.derive import derive_binary_positions, get_condition_id
@@ -18,17 +21,79 @@ USDC_ADDRESS = "0x2791Bca1f2de4661ED88A30C99A7a9449Aa84174"
 # Gamma API 默认端点
 DEFAULT_GAMMA_BASE_URL = "https://gamma-api.polymarket.com"
 
+# 请求超时（秒）
+REQUEST_TIMEOUT = 10
 
-def fetch_event_from_gamma(slug: str, base_url: Optional[str] = None) -> Dict[str, Any]:
+# 条件请求缓存最多保留的响应数，超出时淘汰最久未使用的
+GAMMA_CACHE_SIZE = 256
+
+# 模块级 HTTP 会话：复用 TCP/TLS 连接，避免每次请求重新握手
+_SESSION = requests.Session()
+_SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+_SESSION.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=16))
+
+# 条件请求缓存：(url, 查询参数) -> (ETag, Last-Modified, 响应 JSON)
+_GAMMA_CACHE: "OrderedDict[Tuple[str, Tuple[Tuple[str, str], ...]], Tuple[Optional[str], Optional[str], Any]]" = OrderedDict()
+
+
+def _gamma_get_json(url: str, params: Dict[str, str]) -> Any:
     """
-    从 Gamma API 获取事件信息
+    通过共享会话请求 Gamma API，并用 ETag / Last-Modified 做条件请求
+    
+    服务器返回 304 时直接复用上次的响应内容；缓存按 LRU 保留最多 GAMMA_CACHE_SIZE 条。
+    
+    Args:
+        url: 请求地址
+        params: 查询参数
+        
+    Returns:
+        响应 JSON
+    """
+    key = (url, tuple(sorted(params.items())))
+    cached = _GAMMA_CACHE.get(key)
+    
+    headers = {}
+    if cached is not None:
+        etag, last_modified, _ = cached
+        if etag:
+            headers['If-None-Match'] = etag
+        if last_modified:
+            headers['If-Modified-Since'] = last_modified
+    
+    response = _SESSION.get(url, params=params, headers=headers, timeout=REQUEST_TIMEOUT)
+    if response.status_code == 304 and cached is not None:
+        _GAMMA_CACHE.move_to_end(key)
+        return cached[2]
+    response.raise_for_status()
+    
+    data = response.json()
+    etag = response.headers.get('ETag')
+    last_modified = response.headers.get('Last-Modified')
+    if etag or last_modified:
+        _GAMMA_CACHE[key] = (etag, last_modified, data)
+        _GAMMA_CACHE.move_to_end(key)
+        if len(_GAMMA_CACHE) > GAMMA_CACHE_SIZE:
+            _GAMMA_CACHE.popitem(last=False)
+    
+    return data
+
+
+def fetch_event_and_markets(
+    slug: str,
+    base_url: Optional[str] = None
+) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    """
+    从 Gamma API 获取事件信息及其市场列表（只请求一次）
     
     Args:
         slug: 事件 slug
         base_url: Gamma API 基础 URL
         
     Returns:
-        事件信息字典
+        (事件信息字典, 市场信息列表)
+        
+    Raises:
+        ValueError: 事件不存在
     """
     if base_url is None:
         base_url = DEFAULT_GAMMA_BASE_URL
@@ -36,17 +101,32 @@ def fetch_event_from_gamma(slug: str, base_url: Optional[str] = None) -> Dict[st
     # Gamma API v2 使用 slug 参数查询
     url = f"{base_url}/events"
     params = {"slug": slug}
-    response = requests.get(url, params=params)
-    response.raise_for_status()
+    data = _gamma_get_json(url, params)
     
-    data = response.json()
     # API返回一个列表，取第一个匹配的事件
     if isinstance(data, list) and len(data) > 0:
-        return data[0]
+        event_data = data[0]
     elif isinstance(data, dict):
-        return data
+        event_data = data
     else:
         raise ValueError(f"Event not found: {slug}")
+    
+    return event_data, event_data.get('markets', [])
+
+
+def fetch_event_from_gamma(slug: str, base_url: Optional[str] = None) -> Dict[str, Any]:
+    """
+    从 Gamma API 获取事件信息
+    
+    Args:
+        slug: 事件 slug
+        base_url: Gamma API 基础 URL
+        
+    Returns:
+        事件信息字典
+    """
+    event_data, _ = fetch_event_and_markets(slug, base_url)
+    return event_data
 
 
 def fetch_markets_from_gamma(event_slug: str, base_url: Optional[str] = None) -> List[Dict[str, Any]]:
@@ -60,26 +140,11 @@ def fetch_markets_from_gamma(event_slug: str, base_url: Optional[str] = None) ->
     Returns:
         市场信息列表
     """
-    if base_url is None:
-        base_url = DEFAULT_GAMMA_BASE_URL
-    
-    # 先尝试通过事件slug获取
-    url = f"{base_url}/events"
-    params = {"slug": event_slug}
-    response = requests.get(url, params=params)
-    response.raise_for_status()
-    
-    data = response.json()
-    if isinstance(data, list) and len(data) > 0:
-        event_data = data[0]
-    elif isinstance(data, dict):
-        event_data = data
-    else:
+    try:
+        _, markets = fetch_event_and_markets(event_slug, base_url)
+    except ValueError:
         # 如果没找到事件，返回空列表
         return []
-    
-    # 提取市场列表
-    markets = event_data.get('markets', [])
     return markets
 
 
@@ -114,6 +179,26 @@ def validate_market_tokens(
     return yes_match and no_match
 
 
+def _to_hex_token(value: Any) -> str:
+    """
+    将十进制 token ID（非负整数或纯数字字符串）转换为 0x 开头的 64 位十六进制
+    
+    Args:
+        value: Gamma API 返回的 token ID
+        
+    Returns:
+        十六进制 token ID；其它字符串（如已是十六进制）原样返回，其它类型返回空字符串
+    """
+    if isinstance(value, str):
+        # 只接受纯 ASCII 数字，"-5"、" 12 " 之类 int() 能解析的输入不转换
+        if value.isdigit() and value.isascii():
+            return f"0x{int(value):064x}"
+        return value
+    if isinstance(value, int) and not isinstance(value, bool) and value >= 0:
+        return f"0x{value:064x}"
+    return ''
+
+
 def parse_market_from_gamma(market_data: Dict[str, Any]) -> Dict[str, Any]:
     """
     解析 Gamma API 返回的市场数据
@@ -128,38 +213,17 @@ def parse_market_from_gamma(market_data: Dict[str, Any]) -> Dict[str, Any]:
     condition_id = market_data.get('conditionId', '')
     question_id = market_data.get('questionID', '')
     
-    # 处理不同格式的 token IDs
+    # 处理不同格式的 token IDs（clobTokenIds 可能是 JSON 字符串或列表）
     clob_token_ids = market_data.get('clobTokenIds', [])
-    
-    # clobTokenIds可能是字符串或列表
     if isinstance(clob_token_ids, str):
-        # 解析JSON字符串
-        import json
         try:
-            clob_token_ids = json.loads(clob_token_ids)
-        except:
+            clob_token_ids = json.loads(clob_token_ids) if clob_token_ids else []
+        except ValueError:
             clob_token_ids = []
     
     if isinstance(clob_token_ids, list) and len(clob_token_ids) >= 2:
-        # Token IDs可能是整数或字符串
-        yes_token_id = clob_token_ids[0]
-        no_token_id = clob_token_ids[1]
-        
-        # 转换为十六进制字符串格式
-        if isinstance(yes_token_id, (int, str)) and isinstance(no_token_id, (int, str)):
-            if isinstance(yes_token_id, str) and yes_token_id.isdigit():
-                yes_token_id = int(yes_token_id)
-            if isinstance(no_token_id, str) and no_token_id.isdigit():
-                no_token_id = int(no_token_id)
-                
-            # 转换为0x开头的64位十六进制
-            if isinstance(yes_token_id, int):
-                yes_token_id = f"0x{yes_token_id:064x}"
-            if isinstance(no_token_id, int):
-                no_token_id = f"0x{no_token_id:064x}"
-        else:
-            yes_token_id = ''
-            no_token_id = ''
+        yes_token_id = _to_hex_token(clob_token_ids[0])
+        no_token_id = _to_hex_token(clob_token_ids[1])
     else:
         yes_token_id = ''
         no_token_id = ''
@@ -200,10 +264,10 @@ def discover_markets(
     Returns:
         结果字典，包含发现的市场数量和详情
     """
-    from src.db.store import upsert_event, upsert_market
+    from src.db.store import upsert_event, upsert_markets_bulk, write_txn
     
-    # 获取事件信息
-    event_data = fetch_event_from_gamma(event_slug, base_url)
+    # 获取事件信息及市场列表（一次请求）
+    event_data, markets = fetch_event_and_markets(event_slug, base_url)
     
     # 存储事件信息
     event_info = {
@@ -214,10 +278,6 @@ def discover_markets(
         'end_date': event_data.get('endDate'),
         'enable_neg_risk': event_data.get('enableNegRisk', False)
     }
-    event_id = upsert_event(conn, event_info)
-    
-    # 获取市场列表
-    markets = event_data.get('markets', [])
     
     discovered_markets = []
     validated_count = 0
@@ -226,7 +286,6 @@ def discover_markets(
     for market_data in markets:
         # 解析市场信息
         market_info = parse_market_from_gamma(market_data)
-        market_info['event_id'] = event_id
         
         # 验证 token ID（如果需要）
         # 注意：由于Gamma API不提供oracle和questionId信息，我们无法重新计算token ID进行验证
@@ -234,11 +293,20 @@ def discover_markets(
         if validate_tokens and market_info['condition_id'] and market_info['yes_token_id']:
             validated_count += 1
         
-        # 存储市场信息
-        market_id = upsert_market(conn, market_info)
-        market_info['market_id'] = market_id
         discovered_markets.append(market_info)
     
+    # 事件及其所有市场在同一个事务中写入，只提交一次
+    with write_txn(conn):
+        event_id = upsert_event(conn, event_info)
+        
+        for market_info in discovered_markets:
+            market_info['event_id'] = event_id
+        
+        # 批量存储市场信息
+        market_ids = upsert_markets_bulk(conn, discovered_markets)
+        for market_info, market_id in zip(discovered_markets, market_ids):
+            market_info['market_id'] = market_id
+    
     result = {
         'event_slug': event_slug,
         'event_id': event_id,
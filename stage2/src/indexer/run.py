@@ -5,20 +5,67 @@ Trades Indexer - 任务 B
 """
 
 import sqlite3
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
 from datetime import datetime
-from typing import Dict, List, Any, Optional, Tuple
-from decimal import Decimal
+from typing import Dict, Iterable, Iterator, List, Any, Optional, Tuple
 from web3 import Web3
+from web3.exceptions import Web3Exception
 from web3.types import LogReceipt
 
-from src.ctf.trade_decoder import decode_order_filled, ORDER_FILLED_TOPIC
-from src.db.store import fetch_market_by_token_id, insert_trades, update_sync_state
+from src.ctf.trade_decoder import (
+    Trade,
+    decode_order_filled,
+    decode_order_filled_batch,
+    is_order_filled_log,
+    order_filled_token_bytes,
+    ORDER_FILLED_TOPIC
+)
+from src.ctf.trade_decoder_fast import warm_up as warm_up_batch_decoder
+from src.db.store import (
+    TradeRecord,
+    fetch_markets_by_token,
+    fetch_block_timestamps,
+    deferred_trade_indexes,
+    has_trades,
+    save_block_timestamps,
+    bulk_insert_trades,
+    update_sync_state,
+    write_txn
+)
 
 
 # Polymarket 交易所合约地址
 CTF_EXCHANGE = "0x4bFb41d5B3570DeFd03C39a9A4D8dE6Bd8B8982E"  # 普通二元市场
 NEGRISK_CTF_EXCHANGE = "0xC5d563A36AE78145C45a50134d48A1215220f80a"  # 负风险市场
 
+# 每个 JSON-RPC 批量请求包含的 eth_getBlockByNumber 数量（多数节点限制单批数百条）
+TIMESTAMP_BATCH_SIZE = 500
+
+# fetch_logs 内部的 eth_getLogs 窗口大小（区块数）与并发请求数
+LOG_WINDOW_SIZE = 500
+LOG_FETCH_WORKERS = 4
+
+# 节点因结果过多 / 范围过大拒绝 eth_getLogs 时错误信息中的短语（各家节点措辞不同）
+_LOG_LIMIT_ERROR_MARKERS = (
+    "query returned more than",
+    "too many results",
+    "response size exceeded",
+    "block range is too large",
+    "block range too large",
+    "exceed maximum block range",
+)
+
+# 限流类错误：缩小窗口只会发出更多请求，必须原样抛出
+_THROTTLE_ERROR_MARKERS = ("rate limit", "rate-limit", "too many requests", "throttl")
+
+# 空库首次导入且区块范围不小于该值时，导入期间删除 trades 二级索引、结束后一次性重建
+BULK_LOAD_MIN_BLOCKS = 100_000
+
+# 每个分块的区块数：分块获取日志并各自提交，限制内存占用，中断后可从已完成的分块继续
+INDEX_CHUNK_SIZE = 2000
+
 
 def get_block_timestamp(w3: Web3, block_number: int, cache: Dict[int, int]) -> int:
     """
@@ -41,6 +88,48 @@ def get_block_timestamp(w3: Web3, block_number: int, cache: Dict[int, int]) -> i
     return timestamp
 
 
+def _fetch_timestamp_batch(w3: Web3, block_numbers: List[int]) -> List[int]:
+    """以一个 JSON-RPC 批量请求获取一组区块的时间戳（与输入顺序一致）"""
+    # 较早的 web3 版本没有 batch_requests，退回逐个区块请求
+    if not hasattr(w3, 'batch_requests'):
+        return [w3.eth.get_block(block_number)['timestamp'] for block_number in block_numbers]
+
+    with w3.batch_requests() as batch:
+        for block_number in block_numbers:
+            batch.add(w3.eth.get_block(block_number))
+        blocks = batch.execute()
+    
+    return [block['timestamp'] for block in blocks]
+
+
+def prefetch_block_timestamps(w3: Web3, block_numbers: Iterable[int], cache: Dict[int, int]) -> None:
+    """
+    以 JSON-RPC 批量请求预取区块时间戳写入缓存，每 TIMESTAMP_BATCH_SIZE 个区块一个请求，
+    多个批次由 LOG_FETCH_WORKERS 个线程并发发送
+    
+    Args:
+        w3: Web3 实例
+        block_numbers: 需要时间戳的区块号（可重复）
+        cache: 时间戳缓存字典
+    """
+    missing = sorted(set(block_numbers).difference(cache))
+    batches = [
+        missing[i:i + TIMESTAMP_BATCH_SIZE]
+        for i in range(0, len(missing), TIMESTAMP_BATCH_SIZE)
+    ]
+    if not batches:
+        return
+    
+    if len(batches) == 1:
+        results = [_fetch_timestamp_batch(w3, batches[0])]
+    else:
+        with ThreadPoolExecutor(max_workers=min(LOG_FETCH_WORKERS, len(batches))) as executor:
+            results = list(executor.map(lambda batch_blocks: _fetch_timestamp_batch(w3, batch_blocks), batches))
+    
+    for batch_blocks, timestamps in zip(batches, results):
+        cache.update(zip(batch_blocks, timestamps))
+
+
 def format_timestamp(unix_timestamp: int) -> str:
     """
     格式化时间戳为 ISO 8601 格式
@@ -51,71 +140,132 @@ def format_timestamp(unix_timestamp: int) -> str:
     Returns:
         ISO 8601 格式的时间字符串
     """
-    return datetime.utcfromtimestamp(unix_timestamp).strftime('%Y-%m-%dT%H:%M:%S')
+    # isoformat 比 strftime 快约 3 倍，秒级精度下输出相同
+    return datetime.utcfromtimestamp(unix_timestamp).isoformat(timespec='seconds')
+
+
+def format_size(raw_amount: str) -> str:
+    """
+    将 6 位小数的链上数量（十进制整数字符串）格式化为十进制数量，去掉末尾多余的 0
+    
+    与 str(Decimal(raw_amount) / Decimal(10**6)) 结果一致，但只做字符串切片
+    
+    Args:
+        raw_amount: 链上原始数量，如 "81282193"
+        
+    Returns:
+        数量字符串，如 "81.282193"
+    """
+    digits = raw_amount.rjust(7, '0')
+    whole, frac = digits[:-6], digits[-6:].rstrip('0')
+    return f"{whole}.{frac}" if frac else whole
 
 
 def parse_trade_from_log(
     log: LogReceipt,
     timestamp: str,
-    conn: sqlite3.Connection
-) -> Optional[Dict[str, Any]]:
+    markets_by_token: Dict[str, Tuple[Dict[str, Any], str]],
+    trade: Optional[Trade] = None,
+    block_number: Optional[int] = None
+) -> Optional[TradeRecord]:
     """
     从日志解析交易信息
     
     Args:
         log: Web3 日志对象
         timestamp: 时间戳
-        conn: 数据库连接
+        markets_by_token: token_id（小写）到 (市场, outcome) 的映射，见 store.fetch_markets_by_token
+        trade: 已批量解码的 Trade (可选，未提供时逐条解码)
+        block_number: 日志所在区块 (可选，调用方已读取时传入，避免重复访问日志字段)
         
     Returns:
-        交易信息字典，如果无法匹配市场则返回 None
+        交易记录，如果无法匹配市场则返回 None
     """
     # 解码日志
-    trade = decode_order_filled(log)
+    if trade is None:
+        trade = decode_order_filled(log)
     
     # 确定 token_id（交易的头寸 token）
     token_id = trade.token_id
     
-    # 查找对应的市场
-    market = fetch_market_by_token_id(conn, token_id)
-    if not market:
-        print(f"Warning: Cannot find market for token_id {token_id} in tx {trade.tx_hash}")
+    # 查找对应的市场及 outcome（YES 或 NO）
+    # 解码器输出的 token_id 已是规范小写形式（0x + 64 位十六进制），可直接查表
+    # 无法匹配时由调用方汇总告警，避免逐条输出
+    match = markets_by_token.get(token_id)
+    if match is None:
         return None
-    
-    # 确定 outcome（YES 或 NO）
-    if token_id.lower() == market['yes_token_id'].lower():
-        outcome = "YES"
-    elif token_id.lower() == market['no_token_id'].lower():
-        outcome = "NO"
-    else:
-        outcome = "UNKNOWN"
+    market, outcome = match
     
     # 构建交易记录
-    trade_record = {
-        'market_id': market['market_id'],
-        'tx_hash': trade.tx_hash,
-        'log_index': trade.log_index,
-        'block_number': log['blockNumber'],
-        'timestamp': timestamp,
-        'exchange': trade.exchange,
-        'order_hash': trade.order_hash,
-        'maker': trade.maker,
-        'taker': trade.taker,
-        'side': trade.side,
-        'outcome': outcome,
-        'price': trade.price,
-        'size': str(Decimal(trade.taker_amount if trade.side == "BUY" else trade.maker_amount) / Decimal(10**6)),
-        'token_id': token_id,
-        'maker_asset_id': trade.maker_asset_id,
-        'taker_asset_id': trade.taker_asset_id,
-        'maker_amount': trade.maker_amount,
-        'taker_amount': trade.taker_amount,
-        'fee': trade.fee
-    }
+    trade_record = TradeRecord(
+        market_id=market['market_id'],
+        tx_hash=trade.tx_hash,
+        log_index=trade.log_index,
+        block_number=log['blockNumber'] if block_number is None else block_number,
+        timestamp=timestamp,
+        exchange=trade.exchange,
+        order_hash=trade.order_hash,
+        maker=trade.maker,
+        taker=trade.taker,
+        side=trade.side,
+        outcome=outcome,
+        price=trade.price,
+        size=format_size(trade.taker_amount if trade.side == "BUY" else trade.maker_amount),
+        token_id=token_id,
+        maker_asset_id=trade.maker_asset_id,
+        taker_asset_id=trade.taker_asset_id,
+        maker_amount=trade.maker_amount,
+        taker_amount=trade.taker_amount,
+        fee=trade.fee
+    )
     
     return trade_record
 
 
+def _is_log_limit_error(exc: Exception) -> bool:
+    """eth_getLogs 错误是否为节点的结果数 / 区块范围限制（限流错误不算）"""
+    message = str(exc).lower()
+    if any(marker in message for marker in _THROTTLE_ERROR_MARKERS):
+        return False
+    return any(marker in message for marker in _LOG_LIMIT_ERROR_MARKERS)
+
+
+def _fetch_log_window(
+    w3: Web3,
+    from_block: int,
+    to_block: int,
+    exchange_addresses: List[str]
+) -> List[LogReceipt]:
+    """
+    获取单个窗口的日志；节点因结果过多拒绝时二分窗口后重试
+    
+    Args:
+        w3: Web3 实例
+        from_block: 起始区块
+        to_block: 结束区块
+        exchange_addresses: 交易所合约地址列表
+        
+    Returns:
+        日志列表（按区块、日志索引排序）
+    """
+    try:
+        return w3.eth.get_logs({
+            'fromBlock': from_block,
+            'toBlock': to_block,
+            'address': exchange_addresses,
+            'topics': [ORDER_FILLED_TOPIC]
+        })
+    except (ValueError, Web3Exception) as exc:
+        if from_block >= to_block or not _is_log_limit_error(exc):
+            raise
+    
+    middle = (from_block + to_block) // 2
+    return (
+        _fetch_log_window(w3, from_block, middle, exchange_addresses)
+        + _fetch_log_window(w3, middle + 1, to_block, exchange_addresses)
+    )
+
+
 def fetch_logs(
     w3: Web3,
     from_block: int,
@@ -125,6 +275,9 @@ def fetch_logs(
     """
     获取指定区块范围内的 OrderFilled 日志
     
+    范围按 LOG_WINDOW_SIZE 切分为多个窗口，由 LOG_FETCH_WORKERS 个线程并发请求，
+    结果按窗口顺序拼接，保持区块、日志索引的顺序。
+    
     Args:
         w3: Web3 实例
         from_block: 起始区块
@@ -134,14 +287,96 @@ def fetch_logs(
     Returns:
         日志列表
     """
-    logs = w3.eth.get_logs({
-        'fromBlock': from_block,
-        'toBlock': to_block,
-        'address': exchange_addresses,
-        'topics': [ORDER_FILLED_TOPIC]
-    })
+    windows = [
+        (start, min(start + LOG_WINDOW_SIZE - 1, to_block))
+        for start in range(from_block, to_block + 1, LOG_WINDOW_SIZE)
+    ]
+    if len(windows) <= 1:
+        return _fetch_log_window(w3, from_block, to_block, exchange_addresses)
     
-    return logs
+    with ThreadPoolExecutor(max_workers=min(LOG_FETCH_WORKERS, len(windows))) as executor:
+        results = executor.map(
+            lambda window: _fetch_log_window(w3, window[0], window[1], exchange_addresses),
+            windows
+        )
+        return [log for window_logs in results for log in window_logs]
+
+
+def index_logs(
+    w3: Web3,
+    conn: sqlite3.Connection,
+    logs: List[LogReceipt],
+    to_block: int,
+    sync_state_key: str,
+    timestamp_cache: Dict[int, int],
+    markets_by_token: Dict[str, Tuple[Dict[str, Any], str]]
+) -> Tuple[int, int, int, List[TradeRecord]]:
+    """
+    解析一批日志并写入数据库，同一事务中把同步状态推进到 to_block
+    
+    Args:
+        w3: Web3 实例
+        conn: 数据库连接
+        logs: 该区块范围内的 OrderFilled 日志
+        to_block: 该批日志的结束区块
+        sync_state_key: 同步状态键
+        timestamp_cache: 区块时间戳缓存（跨分块复用，本批用到的区块会写入 block_timestamps 表）
+        markets_by_token: token_id（小写）到 (市场, outcome) 的映射
+        
+    Returns:
+        (解析条数, 插入条数, 跳过条数, 前 5 条交易记录)
+    """
+    # 批量取回本批日志涉及的区块时间戳（run_indexer 已在预取日志时完成，这里只补缺）
+    prefetch_block_timestamps(w3, (log['blockNumber'] for log in logs), timestamp_cache)
+    
+    # 批量解码日志
+    decoded_trades = decode_order_filled_batch(logs)
+    
+    parsed_count = 0
+    skipped = 0
+    sample_trades = []
+    
+    # 同一区块的日志共用时间戳，每个区块只格式化一次
+    formatted_timestamps = {}
+    
+    def parsed_trades() -> Iterator[TradeRecord]:
+        """逐条解析交易并直接交给 executemany，不构建中间列表"""
+        nonlocal parsed_count, skipped
+        
+        for log, decoded in zip(logs, decoded_trades):
+            # 获取时间戳
+            block_number = log['blockNumber']
+            timestamp = formatted_timestamps.get(block_number)
+            if timestamp is None:
+                unix_timestamp = get_block_timestamp(w3, block_number, timestamp_cache)
+                timestamp = formatted_timestamps[block_number] = format_timestamp(unix_timestamp)
+            
+            # 解析交易
+            trade_record = parse_trade_from_log(log, timestamp, markets_by_token, decoded, block_number)
+            if trade_record is None:
+                skipped += 1
+                continue
+            
+            parsed_count += 1
+            if len(sample_trades) < 5:
+                sample_trades.append(trade_record)
+            yield trade_record
+    
+    # 交易与同步状态在同一个事务中提交
+    with write_txn(conn):
+        # 流式批量插入交易
+        inserted_count = bulk_insert_trades(conn, parsed_trades())
+        
+        # 持久化本批用到的区块时间戳，下次运行同一范围时无需请求 RPC
+        save_block_timestamps(conn, {bn: timestamp_cache[bn] for bn in formatted_timestamps})
+        
+        # 更新同步状态
+        update_sync_state(conn, sync_state_key, to_block)
+    
+    if skipped:
+        print(f"Warning: Skipped {skipped} trades with no matching market")
+    
+    return parsed_count, inserted_count, skipped, sample_trades
 
 
 def run_indexer(
@@ -150,11 +385,15 @@ def run_indexer(
     from_block: int,
     to_block: int,
     exchange_addresses: Optional[List[str]] = None,
-    sync_state_key: str = "trade_indexer"
+    sync_state_key: str = "trade_indexer",
+    chunk_size: int = INDEX_CHUNK_SIZE
 ) -> Dict[str, Any]:
     """
     运行交易索引器（任务 B）
     
+    区块范围按 chunk_size 分块：后台线程预取下一块的日志，同时在当前线程解析并写入本块，
+    网络请求与数据库写入重叠进行；每块提交后 sync_state 即推进到该块末尾。
+    
     Args:
         w3: Web3 实例
         conn: 数据库连接
@@ -162,6 +401,7 @@ def run_indexer(
         to_block: 结束区块
         exchange_addresses: 交易所合约地址列表
         sync_state_key: 同步状态键
+        chunk_size: 每块的区块数
         
     Returns:
         索引结果字典
@@ -169,43 +409,84 @@ def run_indexer(
     if exchange_addresses is None:
         exchange_addresses = [CTF_EXCHANGE, NEGRISK_CTF_EXCHANGE]
     
-    # 获取日志
-    print(f"Fetching logs from block {from_block} to {to_block}...")
-    logs = fetch_logs(w3, from_block, to_block, exchange_addresses)
-    print(f"Found {len(logs)} OrderFilled events")
+    chunks = [
+        (start, min(start + chunk_size - 1, to_block))
+        for start in range(from_block, to_block + 1, chunk_size)
+    ]
     
-    # 解析交易
-    timestamp_cache = {}
-    trades = []
-    skipped = 0
+    # 市场数量远小于交易数量，整批预加载后按 token_id 匹配，无需逐条查询数据库
+    markets_by_token = fetch_markets_by_token(conn)
     
-    for log in logs:
-        # 获取时间戳
-        block_number = log['blockNumber']
-        unix_timestamp = get_block_timestamp(w3, block_number, timestamp_cache)
-        timestamp = format_timestamp(unix_timestamp)
-        
-        # 解析交易
-        trade_record = parse_trade_from_log(log, timestamp, conn)
-        if trade_record:
-            trades.append(trade_record)
-        else:
-            skipped += 1
+    # 以数据库中已保存的区块时间戳预热缓存
+    timestamp_cache = fetch_block_timestamps(conn, from_block, to_block)
+    
+    # 已跟踪市场的 token ID（32 字节），用于解码前剔除其它市场的日志
+    tracked_tokens = set()
+    for token_id in markets_by_token:
+        try:
+            tracked_tokens.add(bytes.fromhex(token_id[2:]))
+        except ValueError:
+            continue
     
-    # 批量插入交易
-    inserted_count = insert_trades(conn, trades)
+    def fetch_chunk(chunk: Tuple[int, int]) -> Tuple[List[LogReceipt], int]:
+        start, end = chunk
+        print(f"Fetching logs from block {start} to {end}...")
+        logs = fetch_logs(w3, start, end, exchange_addresses)
+        # 节点已按 topic 过滤，这里再以 bytes 比较剔除异常日志；
+        # token ID 不是 indexed 参数，无法交给节点过滤，在此直接比较 data 中的原始字节
+        order_filled = [log for log in logs if is_order_filled_log(log)]
+        tracked = [log for log in order_filled if order_filled_token_bytes(log) in tracked_tokens]
+        # 区块时间戳也在后台线程中取回，主线程只负责解码与写库
+        prefetch_block_timestamps(w3, (log['blockNumber'] for log in tracked), timestamp_cache)
+        return tracked, len(order_filled)
     
-    # 更新同步状态
-    update_sync_state(conn, sync_state_key, to_block)
+    total_logs = 0
+    parsed_count = 0
+    inserted_count = 0
+    skipped = 0
+    sample_trades = []
+    
+    # 空库的大范围回填：排序后一次性建索引比逐行维护 B-tree 更快；已有数据时 API 仍依赖索引，不做此优化
+    bulk_load = to_block - from_block + 1 >= BULK_LOAD_MIN_BLOCKS and not has_trades(conn)
+    index_context = deferred_trade_indexes(conn) if bulk_load else nullcontext()
+    
+    with index_context, ThreadPoolExecutor(max_workers=1) as executor:
+        pending = executor.submit(fetch_chunk, chunks[0]) if chunks else None
+        
+        # 等待首块日志期间完成批量解码内核的 JIT 编译 / 缓存加载；失败时批量解码会自行回退
+        try:
+            warm_up_batch_decoder()
+        except Exception as e:
+            print(f"Batch decoder warm-up failed: {e}", file=sys.stderr)
+        
+        for i, (_, end) in enumerate(chunks):
+            logs, chunk_total = pending.result()
+            
+            # 预取下一块的日志
+            if i + 1 < len(chunks):
+                pending = executor.submit(fetch_chunk, chunks[i + 1])
+            
+            untracked = chunk_total - len(logs)
+            print(f"Found {chunk_total} OrderFilled events ({untracked} for untracked markets)")
+            parsed, inserted, chunk_skipped, chunk_samples = index_logs(
+                w3, conn, logs, end, sync_state_key, timestamp_cache, markets_by_token
+            )
+            
+            total_logs += chunk_total
+            parsed_count += parsed
+            inserted_count += inserted
+            skipped += untracked + chunk_skipped
+            if len(sample_trades) < 5:
+                sample_trades.extend(trade._asdict() for trade in chunk_samples[:5 - len(sample_trades)])
     
     result = {
         'from_block': from_block,
         'to_block': to_block,
-        'total_logs': len(logs),
-        'parsed_trades': len(trades),
+        'total_logs': total_logs,
+        'parsed_trades': parsed_count,
         'inserted_trades': inserted_count,
         'skipped_trades': skipped,
-        'sample_trades': trades[:5] if trades else []
+        'sample_trades': sample_trades
     }
     
     return result
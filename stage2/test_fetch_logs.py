@@ -0,0 +1,68 @@
+"""
+fetch_logs 测试：节点限制结果数时二分窗口，限流等其它错误原样抛出
+
+运行: python -m pytest test_fetch_logs.py  或  python test_fetch_logs.py
+"""
+import threading
+from types import SimpleNamespace
+
+from src.indexer.run import _fetch_log_window, fetch_logs
+
+
+class FakeEth:
+    """每个区块一条日志；查询范围超过 max_blocks 时抛出 error"""
+
+    def __init__(self, max_blocks: int, error: Exception):
+        self.max_blocks = max_blocks
+        self.error = error
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def get_logs(self, params):
+        from_block, to_block = params['fromBlock'], params['toBlock']
+        with self._lock:
+            self.calls.append((from_block, to_block))
+        if to_block - from_block + 1 > self.max_blocks:
+            raise self.error
+        return [{'blockNumber': block, 'logIndex': 0} for block in range(from_block, to_block + 1)]
+
+
+def make_w3(max_blocks: int, error: Exception) -> SimpleNamespace:
+    return SimpleNamespace(eth=FakeEth(max_blocks, error))
+
+
+def test_limit_error_bisects_windows_in_order():
+    w3 = make_w3(100, ValueError({'code': -32005, 'message': 'query returned more than 10000 results'}))
+
+    logs = fetch_logs(w3, 1000, 2999, [])
+
+    assert [log['blockNumber'] for log in logs] == list(range(1000, 3000))
+    # 超限的窗口被拆分，成功的请求恰好无缝覆盖整个范围
+    assert any(to_block - from_block + 1 > 100 for from_block, to_block in w3.eth.calls)
+    served = sorted(
+        (from_block, to_block)
+        for from_block, to_block in w3.eth.calls
+        if to_block - from_block + 1 <= 100
+    )
+    assert served[0][0] == 1000 and served[-1][1] == 2999
+    assert all(prev[1] + 1 == cur[0] for prev, cur in zip(served, served[1:]))
+
+
+def test_rate_limit_error_is_raised_without_bisecting():
+    error = ValueError({'code': 429, 'message': 'Too Many Requests: rate limit exceeded'})
+    w3 = make_w3(100, error)
+
+    try:
+        _fetch_log_window(w3, 0, 499, [])
+    except ValueError as exc:
+        assert exc is error
+    else:
+        raise AssertionError("rate-limit error was swallowed")
+
+    assert w3.eth.calls == [(0, 499)]
+
+
+if __name__ == "__main__":
+    test_limit_error_bisects_windows_in_order()
+    test_rate_limit_error_is_raised_without_bisecting()
+    print("OK")
@@ -0,0 +1,97 @@
+"""
+迁移测试：旧数据库中文本形式的 token_id / order_hash 在 init_db 时转为 BLOB
+
+运行: python -m pytest test_migrate_blob_ids.py  或  python test_migrate_blob_ids.py
+"""
+import os
+import sqlite3
+import tempfile
+
+from src.db.migrate_blob_ids import MIGRATE_BATCH_SIZE
+from src.db.schema import init_db
+from src.db.store import fetch_trades_for_token
+
+
+# 迁移前（VARCHAR 存储十六进制 ID）的 trades 表
+BASELINE_TRADES_DDL = """
+    CREATE TABLE trades (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        market_id INTEGER NOT NULL,
+        tx_hash VARCHAR(66) NOT NULL,
+        log_index INTEGER NOT NULL,
+        block_number INTEGER NOT NULL,
+        timestamp TIMESTAMP NOT NULL,
+        exchange VARCHAR(42) NOT NULL,
+        order_hash VARCHAR(66) NOT NULL,
+        maker VARCHAR(42) NOT NULL,
+        taker VARCHAR(42) NOT NULL,
+        side VARCHAR(10) NOT NULL,
+        outcome VARCHAR(10) NOT NULL,
+        price VARCHAR(50) NOT NULL,
+        size VARCHAR(50) NOT NULL,
+        token_id VARCHAR(78) NOT NULL,
+        maker_asset_id VARCHAR(78) NOT NULL,
+        taker_asset_id VARCHAR(78) NOT NULL,
+        maker_amount VARCHAR(50) NOT NULL,
+        taker_amount VARCHAR(50) NOT NULL,
+        fee VARCHAR(50) NOT NULL,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(tx_hash, log_index)
+    )
+"""
+
+TOKEN_IDS = (f"0x{1:064x}", f"0x{0xabc:064x}")
+
+
+def build_baseline_db(db_path: str, row_count: int) -> None:
+    """创建旧版 trades 表并写入 row_count 条文本 ID 的交易（两个 token 交替）"""
+    conn = sqlite3.connect(db_path)
+    conn.execute(BASELINE_TRADES_DDL)
+    conn.execute("CREATE INDEX idx_trades_token_id ON trades(token_id)")
+    conn.executemany(
+        """
+        INSERT INTO trades (
+            market_id, tx_hash, log_index, block_number, timestamp,
+            exchange, order_hash, maker, taker, side, outcome,
+            price, size, token_id, maker_asset_id, taker_asset_id,
+            maker_amount, taker_amount, fee
+        )
+        VALUES (1, ?, 0, ?, '2024-01-01T00:00:00', '0x0', ?, '0x0', '0x0',
+                'BUY', 'YES', '0.5', '1', ?, '0', '1', '1', '2', '0')
+        """,
+        [
+            (f"0x{i:064x}", i, f"0x{i:064x}", TOKEN_IDS[i % 2])
+            for i in range(row_count)
+        ]
+    )
+    conn.commit()
+    conn.close()
+
+
+def test_init_db_migrates_text_ids_across_batches():
+    row_count = MIGRATE_BATCH_SIZE * 2 + 7
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "baseline.db")
+        build_baseline_db(db_path, row_count)
+
+        conn = init_db(db_path)
+        try:
+            types = conn.execute("""
+                SELECT typeof(token_id), typeof(order_hash), COUNT(*)
+                FROM trades GROUP BY 1, 2
+            """).fetchall()
+            assert types == [('blob', 'blob', row_count)]
+
+            fetched = sum(
+                len(fetch_trades_for_token(conn, token_id, limit=row_count))
+                for token_id in TOKEN_IDS
+            )
+            assert fetched == row_count
+        finally:
+            conn.close()
+
+
+if __name__ == "__main__":
+    test_init_db_migrates_text_ids_across_batches()
+    print("OK")